@@ -1,45 +1,56 @@
 import streamlit as st
-import PyPDF2
-import groq
-import os
 from streamlit.components.v1 import html
 import re
 import json
 import textwrap
+import time
+from concurrent.futures import ThreadPoolExecutor
+from diagrams import SVG_DEFS
+from jobs import find_or_submit, follow_job, get_job_client, load_job_trace
+from llm_cache import cached_completion
+from pdf_ingest import SECTION_KEYWORDS, ingest_pdf
+from summarize import format_report, map_reduce_summarize
+from tracing import Trace, bind, render_trace_sidebar, span
+from model_registry import get_model, warm_up
 
-GROQ_API_KEY = os.getenv("GROQ_API_KEY", "your_api_key")
-client = groq.Client(api_key=GROQ_API_KEY)
+# The Groq client is created on first use by the model registry (GROQ_API_KEY is read there)
+GROQ_MODEL = "llama3-70b-8192"
+# llama3-70b-8192 has an 8k context; longer papers are condensed map-reduce style to fit next to the prompt
+GROQ_INPUT_TOKEN_BUDGET = 5000
+SUMMARY_CONFIG = {"max_tokens": 600, "temperature": 0.2}
 
 def extract_text_from_pdf(uploaded_file):
-    """Extracts text from the uploaded PDF file with better section handling."""
+    """Extracts the abstract and methodology of the uploaded PDF, or the paper body if they are not found."""
     try:
-        pdf_reader = PyPDF2.PdfReader(uploaded_file)
-        text = ""
-        for page in pdf_reader.pages:
-            page_text = page.extract_text()
-            if page_text:
-                # Remove excessive whitespace and normalize line breaks
-                page_text = re.sub(r'\s+', ' ', page_text)
-                text += page_text + "\n"
-        
-        # Extract abstract and methodology sections if present
-        abstract_match = re.search(r'abstract[:\s]+(.*?)\n\s*(?:introduction|methods|methodology)', 
-                                 text.lower(), re.DOTALL)
-        methods_match = re.search(r'(?:methods|methodology)[:\s]+(.*?)\n\s*(?:results|discussion)', 
-                                text.lower(), re.DOTALL)
+        paper = ingest_pdf(uploaded_file)
+        # Sections come from the layout outline found at ingestion, so only they are sent to the prompts
+        abstract = paper.select_text(SECTION_KEYWORDS["abstract"])
+        methods = paper.select_text(SECTION_KEYWORDS["methods"])
         
         extracted_text = ""
-        if abstract_match:
-            extracted_text += "ABSTRACT:\n" + abstract_match.group(1) + "\n\n"
-        if methods_match:
-            extracted_text += "METHODOLOGY:\n" + methods_match.group(1)
+        if abstract:
+            extracted_text += "ABSTRACT:\n" + re.sub(r'\s+', ' ', abstract) + "\n\n"
+        if methods:
+            extracted_text += "METHODOLOGY:\n" + re.sub(r'\s+', ' ', methods)
         
-        return extracted_text if extracted_text else text[:15000]
+        # Otherwise everything but the references and appendices, with runs of spaces collapsed
+        return extracted_text if extracted_text else re.sub(r'[ \t\r\f\v]+', ' ', paper.body_text)
     except Exception as e:
         st.error(f"Error extracting PDF text: {str(e)}")
         return None
 
-def extract_workflow(text):
+def summarize_with_groq(prompt, model=GROQ_MODEL):
+    messages = [{"role": "user", "content": prompt}]
+    return cached_completion(
+        model, messages, SUMMARY_CONFIG,
+        lambda: get_model("groq").chat.completions.create(model=model, messages=messages, **SUMMARY_CONFIG).choices[0].message.content
+    )
+
+def condense_text(text, model=GROQ_MODEL, token_budget=GROQ_INPUT_TOKEN_BUDGET):
+    """Returns (text, token report), summarizing the paper chunk by chunk if it exceeds the budget."""
+    return map_reduce_summarize(text, lambda prompt: summarize_with_groq(prompt, model), token_budget)
+
+def extract_workflow(text, model=GROQ_MODEL, use_cache=True):
     """Enhanced workflow extraction with better prompting."""
     try:
         prompt = f"""Analyze this research paper text and extract the exact workflow/methodology in a sequential format.
@@ -61,17 +72,18 @@ def extract_workflow(text):
         Research Text:
         {text}"""
 
-        response = client.chat.completions.create(
-            model="llama3-70b-8192",
-            messages=[
-                {"role": "system", "content": "You are a research methodology expert. Extract precise, actionable steps from research papers."},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=1000,
-            temperature=0.3
+        messages = [
+            {"role": "system", "content": "You are a research methodology expert. Extract precise, actionable steps from research papers."},
+            {"role": "user", "content": prompt}
+        ]
+        config = {"max_tokens": 1000, "temperature": 0.3}
+        response_text = cached_completion(
+            model, messages, config,
+            lambda: get_model("groq").chat.completions.create(model=model, messages=messages, **config).choices[0].message.content,
+            use_cache=use_cache
         )
         
-        workflow = response.choices[0].message.content.strip()
+        workflow = response_text.strip()
         
         # Clean up the workflow format
         workflow = re.sub(r'Step\s*', 'step', workflow, flags=re.IGNORECASE)
@@ -122,7 +134,7 @@ def generate_mermaid_diagram(workflow_text):
         st.error(f"Error generating Mermaid diagram: {str(e)}")
         return None
 
-def extract_paper_components(text):
+def extract_paper_components(text, model=GROQ_MODEL, use_cache=True):
     """Enhanced component extraction with better prompting and error handling."""
     try:
         prompt = f"""Analyze this research paper and extract key components. 
@@ -157,18 +169,19 @@ def extract_paper_components(text):
 
         Text: {text}"""
 
-        response = client.chat.completions.create(
-            model="llama3-70b-8192",
-            messages=[
-                {"role": "system", "content": "You are a precise research paper analyzer that extracts key components and formats them as valid JSON."},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=1000,
-            temperature=0.2
+        messages = [
+            {"role": "system", "content": "You are a precise research paper analyzer that extracts key components and formats them as valid JSON."},
+            {"role": "user", "content": prompt}
+        ]
+        config = {"max_tokens": 1000, "temperature": 0.2}
+        response_text = cached_completion(
+            model, messages, config,
+            lambda: get_model("groq").chat.completions.create(model=model, messages=messages, **config).choices[0].message.content,
+            use_cache=use_cache
         )
         
         # Clean and parse response
-        response_text = response.choices[0].message.content.strip()
+        response_text = response_text.strip()
         
         # Remove any markdown code block markers
         response_text = re.sub(r'```json\s*|\s*```', '', response_text)
@@ -230,39 +243,7 @@ def generate_graphical_abstract_svg(components):
         
         svg = f'''
         <svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {width} {height}">
-            <defs>
-                <filter id="shadow" x="-20%" y="-20%" width="140%" height="140%">
-                    <feGaussianBlur in="SourceAlpha" stdDeviation="4"/>
-                    <feOffset dx="3" dy="3"/>
-                    <feComponentTransfer>
-                        <feFuncA type="linear" slope="0.3"/>
-                    </feComponentTransfer>
-                    <feMerge>
-                        <feMergeNode/>
-                        <feMergeNode in="SourceGraphic"/>
-                    </feMerge>
-                </filter>
-                
-                <linearGradient id="headerGrad" x1="0%" y1="0%" x2="100%" y2="0%">
-                    <stop offset="0%" style="stop-color:#2196F3;stop-opacity:1" />
-                    <stop offset="100%" style="stop-color:#1976D2;stop-opacity:1" />
-                </linearGradient>
-                
-                <linearGradient id="methodGrad" x1="0%" y1="0%" x2="100%" y2="0%">
-                    <stop offset="0%" style="stop-color:#E3F2FD;stop-opacity:1" />
-                    <stop offset="100%" style="stop-color:#BBDEFB;stop-opacity:1" />
-                </linearGradient>
-                
-                <linearGradient id="findingGrad" x1="0%" y1="0%" x2="100%" y2="0%">
-                    <stop offset="0%" style="stop-color:#E8F5E9;stop-opacity:1" />
-                    <stop offset="100%" style="stop-color:#C8E6C9;stop-opacity:1" />
-                </linearGradient>
-                
-                <linearGradient id="applicationGrad" x1="0%" y1="0%" x2="100%" y2="0%">
-                    <stop offset="0%" style="stop-color:#FFF3E0;stop-opacity:1" />
-                    <stop offset="100%" style="stop-color:#FFE0B2;stop-opacity:1" />
-                </linearGradient>
-            </defs>
+            {SVG_DEFS}
             
             <!-- Title -->
             <rect x="50" y="30" width="{width-100}" height="80" rx="15" 
@@ -353,85 +334,82 @@ def generate_keywords(keywords, start_x, start_y):
         x += 180  # Increased spacing between keywords
     return "\n".join(svg_keywords)
 
-def render_mermaid(mermaid_code):
-    """Renders Mermaid.js diagram with enhanced styling."""
-    try:
-        mermaid_html = f"""
-        <html>
-            <head>
-                <script src="https://cdn.jsdelivr.net/npm/mermaid@10.2.3/dist/mermaid.min.js"></script>
-                <style>
-                    .mermaid {{
-                        font-family: Arial, sans-serif;
-                        font-size: 16px;
-                    }}
-                </style>
-            </head>
-            <body>
-                <div class="mermaid" style="max-width: 100%; margin: 0 auto;">
-                    {mermaid_code}
-                </div>
-                <script>
-                    var config = {{
-                        startOnLoad: true,
-                        theme: 'default',
-                        securityLevel: 'loose',
-                        flowchart: {{
-                            useMaxWidth: true,
-                            htmlLabels: true,
-                            curve: 'basis',
-                            rankSpacing: 70,
-                            nodeSpacing: 70,
-                            padding: 20
-                        }},
-                        themeVariables: {{
-                            fontFamily: 'Arial',
-                            fontSize: '16px'
-                        }}
-                    }};
-                    mermaid.initialize(config);
-                </script>
-            </body>
-        </html>
-        """
-        html(mermaid_html, height=800, scrolling=True)  # Increased height
-    except Exception as e:
-        st.error(f"Error rendering diagram: {str(e)}")
-
 def render_svg(svg_code):
     """Renders SVG with proper sizing."""
     html(svg_code, height=800, width=1000)  # Increased dimensions
 
+# Independent LLM stages run over the same text; add new ones here to include them in the fan-out
+EXTRACTION_STAGES = {
+    "workflow": extract_workflow,
+    "components": extract_paper_components,
+}
+
+def run_extraction_stages(stages, text, model=GROQ_MODEL):
+    """Runs the extraction stages concurrently and returns their results and durations in seconds."""
+    def run_stage(name, stage):
+        # Each stage is its own span, so the job's trace keeps the per-stage timings
+        with span(f"extraction.{name}"):
+            start = time.perf_counter()
+            result = stage(text, model)
+        return result, time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=len(stages)) as executor:
+        futures = {name: executor.submit(bind(run_stage), name, stage) for name, stage in stages.items()}
+    results = {}
+    timings = {}
+    for name, future in futures.items():
+        results[name], timings[name] = future.result()
+    return results, timings
+
+def format_extraction_timings(trace):
+    """The per-stage timing caption, read from the extraction spans of a (job's) trace."""
+    summary = trace.summary()
+    timings = {name.split(".", 1)[1]: stage["seconds"] for name, stage in summary.items()
+               if name.startswith("extraction.")}
+    total = summary.get("stage.abstract", {}).get("seconds", trace.wall_seconds())
+    return "⏱️ " + " · ".join(f"{name}: {seconds:.2f}s" for name, seconds in timings.items()) + f" · total: {total:.2f}s"
+
 # Streamlit UI with enhanced styling
-st.set_page_config(page_title="Research Paper Visualizer", layout="wide")
-
-# Custom CSS
-st.markdown("""
-    <style>
-        .stTitle {
-            font-size: 2.5rem !important;
-            color: #1976D2 !important;
-            margin-bottom: 2rem !important;
-        }
-        .stSubheader {
-            color: #424242 !important;
-            font-size: 1.5rem !important;
-        }
-        .stButton>button {
-            background-color: #1976D2;
-            color: white;
-            font-size: 1.1rem;
-            padding: 0.5rem 2rem;
-        }
-        .stButton>button:hover {
-            background-color: #1565C0;
-        }
-    </style>
-""", unsafe_allow_html=True)
+def main():
+    # The visualizations are made by a background job, so the sidebar shows that job's trace
+    trace = Trace("visualizer")
+    with trace.activate():
+        job_trace = visualizer_page()
+    render_trace_sidebar(job_trace or trace)
+
+def visualizer_page():
+    st.set_page_config(page_title="Research Paper Visualizer", layout="wide")
+
+    # Load anything listed in WARM_UP_MODELS in the background, once per server process
+    warm_up()
 
-st.title("AI-Powered Research Paper Visualizer")
+    # Custom CSS
+    st.markdown("""
+        <style>
+            .stTitle {
+                font-size: 2.5rem !important;
+                color: #1976D2 !important;
+                margin-bottom: 2rem !important;
+            }
+            .stSubheader {
+                color: #424242 !important;
+                font-size: 1.5rem !important;
+            }
+            .stButton>button {
+                background-color: #1976D2;
+                color: white;
+                font-size: 1.1rem;
+                padding: 0.5rem 2rem;
+            }
+            .stButton>button:hover {
+                background-color: #1565C0;
+            }
+        </style>
+    """, unsafe_allow_html=True)
 
-st.markdown("""
+    st.title("AI-Powered Research Paper Visualizer")
+
+    st.markdown("""
 ### Transform your research paper into interactive visualizations
 
 This tool helps you:
@@ -440,55 +418,85 @@ This tool helps you:
 - Identify and highlight main components of your paper
 """)
 
-uploaded_file = st.file_uploader("Upload your research paper (PDF)", type=["pdf"])
+    uploaded_file = st.file_uploader("Upload your research paper (PDF)", type=["pdf"])
 
-if uploaded_file is not None:
-    with st.spinner("📄 Extracting text from PDF..."):
-        text = extract_text_from_pdf(uploaded_file)
-        if text:
-            st.success("✅ Text extracted successfully!")
-            
-            if st.button("🎨 Generate Visualizations"):
-                with st.spinner("🔄 Analyzing paper and creating visualizations..."):
-                    # Extract workflow
-                    workflow_text = extract_workflow(text)
-                    
-                    # Extract components for graphical abstract
-                    components = extract_paper_components(text)
-                    
-                    if workflow_text and components:
-                        tab1, tab2 = st.tabs(["🔄 Workflow Diagram", "📊 Graphical Abstract"])
-                        
-                        with tab1:
-                            st.markdown("### Research Workflow")
-                            col1, col2 = st.columns([1, 2])
-                            with col1:
-                                st.markdown("#### Extracted Steps")
-                                st.text_area("", workflow_text, height=300)
-                            with col2:
-                                st.markdown("#### Interactive Diagram")
-                                mermaid_code = generate_mermaid_diagram(workflow_text)
-                                if mermaid_code:
-                                    render_mermaid(mermaid_code)
-                                    st.download_button(
-                                        "💾 Download Mermaid Code",
-                                        mermaid_code,
-                                        file_name="workflow_diagram.mmd",
-                                        mime="text/plain"
-                                    )
-                        
-                        with tab2:
-                            st.markdown("### Graphical Abstract")
-                            svg_code = generate_graphical_abstract_svg(components)
-                            if svg_code:
-                                render_svg(svg_code)
-                                st.download_button(
-                                    "💾 Download SVG",
-                                    svg_code,
-                                    file_name="graphical_abstract.svg",
-                                    mime="image/svg+xml"
-                                )
-                                
-                                # Display extracted components in expandable section
-                                with st.expander("📝 View Extracted Components"):
-                                    st.json(components)
+    if uploaded_file is not None:
+        pdf_bytes = uploaded_file.getvalue()
+        if st.button("🎨 Generate Visualizations"):
+            st.session_state["visualized_file"] = uploaded_file.file_id
+
+        # Keep the visualizations on screen across reruns (e.g. download clicks) for the same file
+        if st.session_state.get("visualized_file") != uploaded_file.file_id:
+            return None
+
+        # The job runs in the background, so a rerun or a closed tab does not lose it
+        client = get_job_client()
+        job_id = find_or_submit(client, pdf_bytes, ["abstract"], uploaded_file.name)
+        job = follow_job(client, job_id, {"abstract": "🔄 Analyzing paper and creating visualizations"})
+        job_trace = load_job_trace(client, job_id)
+        if job["error"]:
+            st.error(f"❌ {job['error']}")
+            return job_trace
+        outputs = {name: client.read_output(job_id, name) for name in job["outputs"]}
+        if job_trace is not None:
+            st.caption(format_extraction_timings(job_trace))
+        if "abstract_token_report.json" in outputs:
+            st.caption("🧮 " + format_report(json.loads(outputs["abstract_token_report.json"])))
+
+        workflow_text = outputs["workflow.txt"].decode("utf-8")
+        components = json.loads(outputs["components.json"])
+        tab1, tab2 = st.tabs(["🔄 Workflow Diagram", "📊 Graphical Abstract"])
+
+        with tab1:
+            st.markdown("### Research Workflow")
+            col1, col2 = st.columns([1, 2])
+            with col1:
+                st.markdown("#### Extracted Steps")
+                st.text_area("", workflow_text, height=300)
+            with col2:
+                st.markdown("#### Diagram")
+                # Laid out and drawn in Python by the job, so no Mermaid CDN or browser rendering is needed
+                if "workflow_diagram.svg" in outputs:
+                    render_svg(outputs["workflow_diagram.svg"].decode("utf-8"))
+                    st.download_button(
+                        "💾 Download SVG",
+                        outputs["workflow_diagram.svg"],
+                        file_name="workflow_diagram.svg",
+                        mime="image/svg+xml"
+                    )
+                    st.download_button(
+                        "💾 Download PNG",
+                        outputs["workflow_diagram.png"],
+                        file_name="workflow_diagram.png",
+                        mime="image/png"
+                    )
+                else:
+                    st.warning("No workflow steps could be parsed for the diagram.")
+                if "workflow_diagram.mmd" in outputs:
+                    st.download_button(
+                        "💾 Download Mermaid Code",
+                        outputs["workflow_diagram.mmd"],
+                        file_name="workflow_diagram.mmd",
+                        mime="text/plain"
+                    )
+
+        with tab2:
+            st.markdown("### Graphical Abstract")
+            if "graphical_abstract.svg" in outputs:
+                render_svg(outputs["graphical_abstract.svg"].decode("utf-8"))
+                st.download_button(
+                    "💾 Download SVG",
+                    outputs["graphical_abstract.svg"],
+                    file_name="graphical_abstract.svg",
+                    mime="image/svg+xml"
+                )
+
+                # Display extracted components in expandable section
+                with st.expander("📝 View Extracted Components"):
+                    st.json(components)
+
+        return job_trace
+
+# Streamlit runs this file as __main__; importing it (e.g. from batch.py) only defines the stages
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,28 @@
-import fitz  # PyMuPDF
 import os
 import google.generativeai as genai
 import re
+import io
 import requests
 import json
+import hashlib
+import random
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pydub import AudioSegment
 import streamlit as st
+from llm_cache import cached_completion, get_llm_cache
+from pdf_ingest import ingest_pdf
+from rate_limit import get_limiter
+from summarize import format_report, map_reduce_summarize
+from jobs import find_or_submit, follow_job, get_job_client, load_job_trace
+from tracing import Trace, bind, render_trace_sidebar, span
 
 # Murf AI API Endpoint
 API_URL = "https://api.murf.ai/v1/speech/generate"
-API_KEY=""
+API_KEY=os.getenv("MURF_API_KEY", "")
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "api_key_here")
 
 # Assign different voices
 VOICES = {
@@ -17,6 +30,119 @@ VOICES = {
     "Guest": "en-IN-aarav"  # Choose an Indian male voice for Ishaan
 }
 
+PODCAST_MODEL = "gemini-2.0-flash-exp"
+PODCAST_GENERATION_CONFIG = {
+    "temperature": 1,
+    "top_p": 0.95,
+    "top_k": 40,
+    "max_output_tokens": 8192,
+    "response_mime_type": "text/plain",
+}
+
+# Papers longer than this are condensed with map-reduce summaries before the script prompt
+PODCAST_INPUT_TOKEN_BUDGET = 200000
+SUMMARY_CHUNK_TOKENS = 50000
+SUMMARY_GENERATION_CONFIG = {
+    "temperature": 0.2,
+    "max_output_tokens": 4096,
+}
+
+# TTS request settings
+MAX_CONCURRENT_REQUESTS = 4  # Number of lines synthesized in parallel
+REQUEST_TIMEOUT = (10, 60)  # (connect, read) timeout in seconds for each request
+MAX_RETRIES = 3
+RETRY_BACKOFF = 1.0  # Base delay in seconds, doubled on every retry
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+_thread_local = threading.local()
+
+def _get_session():
+    """Returns a requests session owned by the current worker thread."""
+    if not hasattr(_thread_local, "session"):
+        _thread_local.session = requests.Session()
+    return _thread_local.session
+
+def _request_with_retry(method, url, limiter=None, **kwargs):
+    """Sends a request with a timeout, retrying with backoff on 429/5xx and network errors.
+
+    If limiter names a rate limit, every attempt (retries included) waits for a token from it.
+    """
+    kwargs.setdefault("timeout", REQUEST_TIMEOUT)
+    response = None
+    for attempt in range(MAX_RETRIES + 1):
+        if limiter is not None:
+            get_limiter(limiter).acquire()
+        try:
+            response = _get_session().request(method, url, **kwargs)
+            if response.status_code not in RETRY_STATUS_CODES:
+                return response
+            retry_after = response.headers.get("Retry-After", "")
+        except requests.RequestException as e:
+            print(f"Request to {url} failed: {e}")
+            retry_after = ""
+
+        if attempt == MAX_RETRIES:
+            break
+        # Honour the server's Retry-After if given, otherwise back off exponentially with jitter
+        delay = float(retry_after) if retry_after.isdigit() else RETRY_BACKOFF * (2 ** attempt)
+        time.sleep(delay + random.uniform(0, 0.5))
+    return response
+
+# On-disk cache of synthesized segments, keyed by the request payload
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", ".tts_cache")
+TTS_CACHE_MAX_BYTES = 500 * 1024 * 1024  # Least recently used segments are evicted above this size
+
+_cache_lock = threading.Lock()
+
+def _speech_cache_path(payload):
+    """Maps a Murf payload to its cache file using a hash of the full payload."""
+    key = hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+    return os.path.join(TTS_CACHE_DIR, f"{key}.mp3")
+
+def load_cached_speech(payload):
+    """Returns cached audio bytes for the payload, or None on a cache miss."""
+    path = _speech_cache_path(payload)
+    try:
+        with open(path, "rb") as f:
+            audio_content = f.read()
+        os.utime(path)  # Mark as recently used for LRU eviction
+    except OSError:
+        return None
+    return audio_content
+
+def store_cached_speech(payload, audio_content):
+    """Atomically writes audio bytes to the cache, then evicts old entries if over the size cap."""
+    os.makedirs(TTS_CACHE_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=TTS_CACHE_DIR, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(audio_content)
+        os.replace(tmp_path, _speech_cache_path(payload))
+    except OSError as e:
+        print(f"Could not cache speech segment: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return
+    _evict_cached_speech()
+
+def _evict_cached_speech():
+    """Deletes least recently used segments until the cache fits in TTS_CACHE_MAX_BYTES."""
+    with _cache_lock:
+        entries = []
+        for entry in os.scandir(TTS_CACHE_DIR):
+            if entry.name.endswith(".mp3"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_size <= TTS_CACHE_MAX_BYTES:
+                break
+            try:
+                os.remove(path)
+                total_size -= size
+            except OSError:
+                pass
+
 # Function to generate speech for each line
 def generate_speech(speaker, text, index):
     payload = {
@@ -42,100 +168,159 @@ def generate_speech(speaker, text, index):
         'api-key': API_KEY
     }
 
-    response = requests.post(API_URL, headers=headers, json=payload)
-
-    if response.status_code == 200:
-        response_data = response.json()
-        if "audioFile" in response_data:
-            audio_url = response_data["audioFile"]
-            audio_response = requests.get(audio_url)
-            if audio_response.status_code == 200:
-                filename = f"segment_{index}_{speaker}.mp3"
-                with open(filename, "wb") as f:
-                    f.write(audio_response.content)
-                print(f"Downloaded: {filename}")
-                return filename
+    with span("tts", line=index, speaker=speaker, bytes_in=len(text.encode("utf-8"))) as attrs:
+        # Identical lines skip the API entirely
+        audio_content = load_cached_speech(payload)
+        attrs["cache_hit"] = audio_content is not None
+        if audio_content is None:
+            response = _request_with_retry("POST", API_URL, limiter="tts", headers=headers, json=payload)
+
+            if response is not None and response.status_code == 200:
+                response_data = response.json()
+                if "audioFile" in response_data:
+                    audio_url = response_data["audioFile"]
+                    audio_response = _request_with_retry("GET", audio_url)
+                    if audio_response is not None and audio_response.status_code == 200:
+                        audio_content = audio_response.content
+                        store_cached_speech(payload, audio_content)
+        else:
+            print(f"Loaded line {index} from cache")
+        attrs["bytes_out"] = len(audio_content) if audio_content else 0
+
+    if audio_content is not None:
+        print(f"Synthesized line {index} ({speaker})")
+        return audio_content
     print(f"Error generating speech for {speaker}")
     return None
 
-def audio_generation(script,progress_bar):
-    # Process each line
-    audio_files = []
-    for index, (speaker, text) in enumerate(script):
-        progress_bar.progress((index + 1) / len(script))
-        audio_file = generate_speech(speaker, text, index)
-        if audio_file:
-            audio_files.append(audio_file)
-
-    # Merge all audio files into one
-    final_podcast = AudioSegment.empty()
-    for file in audio_files:
-        segment = AudioSegment.from_mp3(file)
-        final_podcast += segment + AudioSegment.silent(duration=500)  # Adding small pauses
-
-    # Save final podcast
-    final_podcast.export("final_podcast.mp3", format="mp3")
-    print("Podcast created successfully: final_podcast.mp3")
-    
-    for file in audio_files:
-        os.remove(file)
-    return "final_podcast.mp3"
-
-
-def extract_text_pypdf2(pdf_path):
-    try:
-        import PyPDF2
-        text = ""
-        with open(pdf_path, 'rb') as file:
-            reader = PyPDF2.PdfReader(file)
-            num_pages = len(reader.pages)
-            for i in range(num_pages):
-                page = reader.pages[i]
-                text += page.extract_text()
-        return text
-    except ImportError:
-        return "PyPDF2 not installed. Please install it using: pip install PyPDF2"
-    except Exception as e:
-        return f"An error occurred with PyPDF2: {e}"
-
-
-def extract_text_pymupdf(pdf_path):
-    try:
-        doc = fitz.open(pdf_path)
-        text = ""
-        for page in doc:
-            text += page.get_text()
-        return text
-    except Exception as e:
-        return f"An error occurred with PyMuPDF: {e}"
+def merge_audio_segments(audio_contents, pause_duration=500, format="mp3"):
+    """Decodes audio segments from memory and joins them, with pauses, in a single pass."""
+    segments = [AudioSegment.from_file(io.BytesIO(content), format=format) for content in audio_contents]
+    if not segments:
+        return AudioSegment.empty()
+
+    # Bring every segment to the first one's sample format so raw PCM can be joined directly
+    first = segments[0]
+    pause = AudioSegment.silent(duration=pause_duration, frame_rate=first.frame_rate)
+    pause = pause.set_channels(first.channels).set_sample_width(first.sample_width)
+    chunks = []
+    for segment in segments:
+        segment = segment.set_frame_rate(first.frame_rate).set_channels(first.channels).set_sample_width(first.sample_width)
+        chunks.append(segment.raw_data)
+        chunks.append(pause.raw_data)  # Adding small pauses
+    return first._spawn(b"".join(chunks))
+
+def audio_generation(script,progress_bar=None,max_workers=MAX_CONCURRENT_REQUESTS):
+    # Synthesize lines concurrently, keeping results in script order
+    audio_contents = [None] * len(script)
+    completed = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(bind(generate_speech), speaker, text, index): index
+            for index, (speaker, text) in enumerate(script)
+        }
+        # Progress is reported from this thread as segments finish, in any order
+        for future in as_completed(futures):
+            audio_contents[futures[future]] = future.result()
+            completed += 1
+            if progress_bar is not None:
+                progress_bar.progress(completed / len(script))
+    return export_podcast(audio_contents)
+
+def stream_audio_generation(script_lines,max_workers=MAX_CONCURRENT_REQUESTS):
+    """Starts synthesis for each line as it arrives and yields (index, audio bytes) in script order."""
+    pending = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for index, (speaker, text) in enumerate(script_lines):
+            pending.append((index, executor.submit(bind(generate_speech), speaker, text, index)))
+            # Hand back every segment that is already finished at the head of the queue
+            while pending and pending[0][1].done():
+                line_index, future = pending.pop(0)
+                yield line_index, future.result()
+        for line_index, future in pending:
+            yield line_index, future.result()
+
+def export_podcast(audio_contents):
+    """Merges the synthesized segments and encodes the podcast as MP3 bytes."""
+    audio_contents = [content for content in audio_contents if content]
+    if not audio_contents:
+        return None
+
+    # Merge all segments into one and encode it once, entirely in memory
+    with span("audio.merge", segments=len(audio_contents), bytes_in=sum(map(len, audio_contents))) as attrs:
+        final_podcast = merge_audio_segments(audio_contents)
+        buffer = io.BytesIO()
+        final_podcast.export(buffer, format="mp3")
+        attrs["bytes_out"] = buffer.tell()
+    print("Podcast created successfully")
+    return buffer.getvalue()
+
 
 def clean_text(text):
-    match = re.search(r'REFERENCES', text, re.IGNORECASE)
-    return text[:match.start()] if match else text
+    with span("clean_text", bytes_in=len(text.encode("utf-8"))) as attrs:
+        match = re.search(r'REFERENCES', text, re.IGNORECASE)
+        cleaned = text[:match.start()] if match else text
+        attrs["bytes_out"] = len(cleaned.encode("utf-8"))
+    return cleaned
 
-def generate_podcast_script(extracted_text,user_remark):
+def _start_podcast_chat():
+    genai.configure(api_key=GEMINI_API_KEY)
 
+    # Create the model
+    model = genai.GenerativeModel(
+    model_name=PODCAST_MODEL,
+    generation_config=PODCAST_GENERATION_CONFIG,
+    )
 
-    genai.configure(api_key="api_key_here")
+    return model.start_chat()
 
-    # Create the model
-    generation_config = {
-    "temperature": 1,
-    "top_p": 0.95,
-    "top_k": 40,
-    "max_output_tokens": 8192,
-    "response_mime_type": "text/plain",
-    }
+def _podcast_prompt(extracted_text,user_remark):
+    return "This is the text extracted from a research paper:"+extracted_text+"Convert this into an interesting conversation between 2 people just like a podcast. The podcast should only contain dialogues and no extra lines relating to intro and outro music. The first speaker should always be Host. The format of dialogues should be Host:<dialogue> SpeakerName:<dialogue>. please do not include any extra formatting or text other than the dialogues."+user_remark
 
-    model = genai.GenerativeModel(
-    model_name="gemini-2.0-flash-exp",
-    generation_config=generation_config,
+def summarize_with_gemini(prompt):
+    genai.configure(api_key=GEMINI_API_KEY)
+    model = genai.GenerativeModel(model_name=PODCAST_MODEL, generation_config=SUMMARY_GENERATION_CONFIG)
+    return cached_completion(PODCAST_MODEL, [prompt], SUMMARY_GENERATION_CONFIG,
+                             lambda: model.generate_content(prompt).text)
+
+def condense_paper_text(text, token_budget=PODCAST_INPUT_TOKEN_BUDGET):
+    """Returns (text, token report), summarizing the paper chunk by chunk if it exceeds the budget."""
+    return map_reduce_summarize(text, summarize_with_gemini, token_budget, chunk_tokens=SUMMARY_CHUNK_TOKENS)
+
+def generate_podcast_script(extracted_text,user_remark,use_cache=None):
+    # Runs at temperature 1, so each call writes a fresh script unless use_cache=True asks for the stored one
+    prompt = _podcast_prompt(extracted_text,user_remark)
+    return cached_completion(
+        PODCAST_MODEL, [prompt], PODCAST_GENERATION_CONFIG,
+        lambda: _start_podcast_chat().send_message(prompt).text,
+        use_cache=use_cache
     )
 
-    chat_session = model.start_chat()
-    response = chat_session.send_message("This is the text extracted from a research paper:"+extracted_text+"Convert this into an interesting conversation between 2 people just like a podcast. The podcast should only contain dialogues and no extra lines relating to intro and outro music. The first speaker should always be Host. The format of dialogues should be Host:<dialogue> SpeakerName:<dialogue>. please do not include any extra formatting or text other than the dialogues."+user_remark)
-    #print(response.text)
-    return response.text
+def stream_podcast_script(extracted_text,user_remark):
+    """Yields the podcast script in text chunks as Gemini generates it."""
+    chat_session = _start_podcast_chat()
+    get_limiter("llm").acquire()
+    response = chat_session.send_message(_podcast_prompt(extracted_text,user_remark), stream=True)
+    for chunk in response:
+        # Safety-blocked or empty chunks have no parts, and reading their .text raises ValueError
+        if not chunk.parts:
+            continue
+        try:
+            text = chunk.text
+        except ValueError:
+            continue
+        if text:
+            yield text
+
+def iter_script_lines(chunks):
+    """Reassembles streamed text chunks into complete lines."""
+    buffer = ""
+    for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split("\n")
+        yield from lines
+    if buffer:
+        yield buffer
 
 # def format_script_for_murf(script):
 #     murf_script = []
@@ -148,12 +333,9 @@ def generate_podcast_script(extracted_text,user_remark):
 #             murf_script.append(("Ishaan", line.replace("Ishaan:", "").strip()))
 
 #     print(murf_script)
-def format_script_for_murf(script):
-    murf_script = []
-    lines = script.split("\n")
-
+def parse_script_lines(lines):
+    """Yields (role, dialogue) for each "Speaker: Dialogue" line, as soon as it is read."""
     speaker_names = {}  # To store detected speaker names
-    detected_speakers = []  # Keep track of detected speaker order
 
     for line in lines:
         match = re.match(r"^(\w+):\s*(.+)", line)  # Match "Speaker: Dialogue"
@@ -167,9 +349,11 @@ def format_script_for_murf(script):
                 else:  # Second speaker gets the name "Guest"
                     speaker_names[speaker] = "Guest"
 
-            # Append formatted script with standardized speaker names
-            murf_script.append((speaker_names[speaker], dialogue.strip()))
+            # Yield formatted line with standardized speaker names
+            yield (speaker_names[speaker], dialogue.strip())
 
+def format_script_for_murf(script):
+    murf_script = list(parse_script_lines(script.split("\n")))
     print(murf_script)
     return murf_script
 
@@ -205,44 +389,123 @@ def format_script_for_murf(script):
 # if __name__ == "__main__":
 #     main()
 
+# Cached pipeline stages, so Streamlit reruns only redo the stages whose inputs changed
+@st.cache_data(show_spinner=False)
+def load_paper_text(file_hash, _pdf_bytes):
+    """Extracts and cleans the paper text once per uploaded file, leaving out references and appendices."""
+    return clean_text(ingest_pdf(_pdf_bytes).body_text)
+
+@st.cache_data(show_spinner=False)
+def cached_condensed_text(file_hash, model_name, _cleaned_text):
+    return condense_paper_text(_cleaned_text)
+
 # Streamlit UI
-st.title("📜➡️🎙️ AI-Powered Research Paper Podcast Generator")
-
-uploaded_file = st.file_uploader("Upload a Research Paper (PDF)", type=["pdf"])
-
-if uploaded_file:
-    with open("temp.pdf", "wb") as f:
-        f.write(uploaded_file.getbuffer())
-
-    st.success("PDF uploaded successfully! Extracting text...")
-
-    extracted_text = extract_text_pymupdf("temp.pdf")
-    cleaned_text = clean_text(extracted_text)
-    
-    # Add a text box for the user to enter customization remarks
-    user_remark = st.text_area("Add customization remarks for the podcast script", 
-                               placeholder="Example: Make it more humorous, Use a formal tone, Add an expert's opinion, etc.")
-    
-    st.info("Generating podcast script...")
-    podcast_script = generate_podcast_script(cleaned_text,user_remark)
-    
-    st.text_area("Generated Podcast Script", podcast_script, height=300)
-
-    final_script = format_script_for_murf(podcast_script)
-
-    st.info("Generating audio files...")
-    progress_bar = st.progress(0)
-    audio_file_path= audio_generation(final_script, progress_bar)
-
-    # Check if the file exists before trying to read it
-    if os.path.exists(audio_file_path):
-        with open(audio_file_path, "rb") as file:
-            audio_bytes = file.read()
-
-        # Optional: Allow users to listen to the podcast before downloading
-        st.audio(audio_bytes, format="audio/mp3")
-        # Display the download button
-        st.download_button("📥 Download Podcast", audio_bytes, file_name="podcast.mp3", mime="audio/mpeg")
-        
-    else:
-        st.error("❌ Podcast file not found! Please generate the podcast first.")
+def main():
+    # Every script run gets its own trace; stages served from st.cache_data do not appear in it.
+    # A podcast made by a background job shows that job's trace instead.
+    trace = Trace("podcast")
+    with trace.activate():
+        job_trace = podcast_page()
+    render_trace_sidebar(job_trace or trace)
+
+def podcast_page():
+    st.title("📜➡️🎙️ AI-Powered Research Paper Podcast Generator")
+
+    uploaded_file = st.file_uploader("Upload a Research Paper (PDF)", type=["pdf"])
+
+    if uploaded_file:
+        pdf_bytes = uploaded_file.getvalue()
+        file_hash = hashlib.sha256(pdf_bytes).hexdigest()
+
+        st.success("PDF uploaded successfully!")
+
+        # Add a text box for the user to enter customization remarks
+        user_remark = st.text_area("Add customization remarks for the podcast script", 
+                                   placeholder="Example: Make it more humorous, Use a formal tone, Add an expert's opinion, etc.")
+
+        stream_audio = st.checkbox("Start audio while the script is being written",
+                                   help="Synthesizes each line as soon as Gemini writes it")
+
+        voices = tuple(sorted(VOICES.items()))
+        run_key = (file_hash, user_remark, PODCAST_MODEL, voices)
+        streamed_run = st.session_state.get("streamed_podcast")
+
+        if stream_audio and streamed_run and streamed_run[0] == run_key:
+            # Reuse the last streamed run when nothing it depends on has changed
+            _, podcast_script, audio_bytes = streamed_run
+            st.text_area("Generated Podcast Script", podcast_script, height=300)
+        elif stream_audio:
+            # Only streaming runs read the paper here; in job mode the job's own stage does it
+            try:
+                cleaned_text = load_paper_text(file_hash, pdf_bytes)
+            except RuntimeError as e:
+                st.error(f"❌ {e}")
+                st.stop()
+            paper_text, token_report = cached_condensed_text(file_hash, PODCAST_MODEL, cleaned_text)
+            st.caption("🧮 " + format_report(token_report))
+
+            st.info("Generating podcast script and audio...")
+            script_box = st.empty()
+            lines_box = st.expander("🔊 Synthesized lines", expanded=True)
+            script_chunks = []
+            parsed_lines = []
+
+            def show_script_chunks(chunks):
+                for chunk in chunks:
+                    script_chunks.append(chunk)
+                    script_box.text("".join(script_chunks))
+                    yield chunk
+
+            def keep_script_lines(lines):
+                for line in lines:
+                    parsed_lines.append(line)
+                    yield line
+
+            script_lines = keep_script_lines(parse_script_lines(iter_script_lines(show_script_chunks(stream_podcast_script(paper_text,user_remark)))))
+            audio_contents = []
+            for index, audio_content in stream_audio_generation(script_lines):
+                audio_contents.append(audio_content)
+                if audio_content:
+                    # Each finished line is added below the earlier ones, so the transcript builds up as it plays
+                    speaker, text = parsed_lines[index]
+                    lines_box.caption(f"{index + 1}. {speaker}: {text}")
+                    lines_box.audio(audio_content, format="audio/mp3")
+
+            script_box.empty()
+            podcast_script = "".join(script_chunks)
+            st.text_area("Generated Podcast Script", podcast_script, height=300)
+            audio_bytes = export_podcast(audio_contents)
+            st.session_state["streamed_podcast"] = (run_key, podcast_script, audio_bytes)
+        else:
+            # The podcast is made by a background job, so it survives reruns and closed tabs
+            client = get_job_client()
+            job_id = find_or_submit(client, pdf_bytes, ["podcast"], uploaded_file.name, remark=user_remark)
+            job = follow_job(client, job_id, {"podcast_script": "✍️ Generating podcast script",
+                                              "podcast_audio": "🔊 Generating audio files"})
+            if "podcast_token_report.json" in job["outputs"]:
+                st.caption("🧮 " + format_report(json.loads(client.read_output(job_id, "podcast_token_report.json"))))
+            if "podcast_script.txt" in job["outputs"]:
+                podcast_script = client.read_output(job_id, "podcast_script.txt").decode("utf-8")
+                st.text_area("Generated Podcast Script", podcast_script, height=300)
+            audio_bytes = client.read_output(job_id, "podcast.mp3") if "podcast.mp3" in job["outputs"] else None
+            if job["error"]:
+                st.error(f"❌ {job['error']}")
+
+        cache_stats = get_llm_cache().stats()
+        st.sidebar.caption(f"LLM cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses")
+
+        if audio_bytes:
+            # Optional: Allow users to listen to the podcast before downloading
+            st.audio(audio_bytes, format="audio/mp3")
+            # Display the download button
+            st.download_button("📥 Download Podcast", audio_bytes, file_name="podcast.mp3", mime="audio/mpeg")
+
+        else:
+            st.error("❌ Podcast audio could not be generated! Please try again.")
+
+        if not stream_audio:
+            return load_job_trace(client, job_id)
+
+# Streamlit runs this file as __main__; importing it (e.g. from batch.py) only defines the stages
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""HTTP service for the job manager: submit a paper, follow its progress, download the results.
+
+    POST /jobs?stages=podcast,abstract&filename=paper.pdf&remark=...   (body: the PDF)
+    GET  /jobs                      all jobs, newest first
+    GET  /jobs/{id}                 status, options and result files
+    GET  /jobs/{id}/events          progress as server-sent events (resumes from Last-Event-ID)
+    GET  /jobs/{id}/files/{name}    one result file
+
+Usage:
+    python api.py --port 8000
+    JOB_API_URL=http://localhost:8000 streamlit run Podcast.py
+"""
+import argparse
+import json
+from contextlib import asynccontextmanager
+
+from starlette.applications import Starlette
+from starlette.responses import FileResponse, JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+from jobs import DEFAULT_OPTIONS, get_job_manager
+
+MAX_UPLOAD_BYTES = 100 * 1024 * 1024  # Larger uploads are rejected as soon as they pass this size
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+def _error(status_code, message):
+    return JSONResponse({"error": message}, status_code=status_code)
+
+
+async def _read_upload(request, limit=MAX_UPLOAD_BYTES):
+    """Reads the request body, counting bytes as they arrive; Content-Length may be missing or wrong."""
+    if int(request.headers.get("content-length") or 0) > limit:
+        raise UploadTooLarge()
+    chunks = []
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > limit:
+            raise UploadTooLarge()
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+async def submit_job(request):
+    params = request.query_params
+    stages = [stage.strip() for stage in params.get("stages", "").split(",") if stage.strip()]
+    if not stages:
+        return _error(400, "No stages requested")
+    options = {key: params[key] for key in DEFAULT_OPTIONS if key in params}
+    try:
+        if "tts_workers" in options:
+            options["tts_workers"] = int(options["tts_workers"])
+        if "related_figures" in options:
+            options["related_figures"] = options["related_figures"].lower() in ("1", "true", "yes")
+        pdf_bytes = await _read_upload(request)
+        job_id = get_job_manager().submit(pdf_bytes, stages, params.get("filename", "paper.pdf"), **options)
+    except UploadTooLarge:
+        return _error(413, "The PDF is too large")
+    except ValueError as e:
+        return _error(400, str(e))
+    return JSONResponse({"id": job_id}, status_code=202, headers={"Location": f"/jobs/{job_id}"})
+
+
+async def list_jobs(request):
+    return JSONResponse(get_job_manager().list_jobs())
+
+
+async def job_status(request):
+    try:
+        return JSONResponse(get_job_manager().status(request.path_params["job_id"]))
+    except KeyError:
+        return _error(404, "No such job")
+
+
+def _event_stream(job_id, after):
+    # A plain generator, so Starlette iterates it in a worker thread; it blocks between events
+    for item in get_job_manager().events(job_id, after):
+        if item is None:
+            yield ": keep-alive\n\n"
+            continue
+        index, event = item
+        yield f"id: {index}\nevent: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+
+async def job_events(request):
+    job_id = request.path_params["job_id"]
+    try:
+        get_job_manager().status(job_id)
+        after = int(request.headers.get("last-event-id", -1)) + 1
+    except KeyError:
+        return _error(404, "No such job")
+    except ValueError:
+        return _error(400, "Invalid Last-Event-ID")
+    return StreamingResponse(_event_stream(job_id, after), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+async def job_file(request):
+    try:
+        path = get_job_manager().output_path(request.path_params["job_id"], request.path_params["name"])
+    except KeyError:
+        return _error(404, "No such file")
+    return FileResponse(path)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Starts the workers (and resumes unfinished jobs) before the first request rather than on it
+    get_job_manager()
+    yield
+
+
+app = Starlette(routes=[
+    Route("/jobs", submit_job, methods=["POST"]),
+    Route("/jobs", list_jobs, methods=["GET"]),
+    Route("/jobs/{job_id}", job_status, methods=["GET"]),
+    Route("/jobs/{job_id}/events", job_events, methods=["GET"]),
+    Route("/jobs/{job_id}/files/{name}", job_file, methods=["GET"]),
+], lifespan=lifespan)
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+    # One server process: the jobs and their event streams live in its memory
+    uvicorn.run(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
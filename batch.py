@@ -0,0 +1,394 @@
+"""Headless batch runner that turns a folder (or manifest) of papers into podcasts, graphical abstracts and slide decks.
+
+Usage:
+    python batch.py papers/ --output batch_output --workers 4 --llm-rpm 30 --tts-rpm 60
+    python batch.py manifest.txt --stages abstract deck --template DARK
+    python batch.py papers/ --stages corpus deck --related-figures   # decks borrow figures from other papers
+    python batch.py library/ --stages corpus   # only add figures and passages to the corpus indexes
+
+A manifest is a text file with one PDF path per line (relative to the manifest; # starts a comment).
+Each stage's result is checkpointed under <output>/<paper>/, so running the same command again
+after a crash or interruption resumes every paper at its first unfinished stage.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from llm_cache import get_llm_cache
+from pdf_ingest import file_hash, ingest_pdf
+from rate_limit import rate_limit_stats, set_rate_limit
+from tracing import Trace, span
+
+BATCH_WORKERS = 4  # Papers processed at the same time
+STATE_FILE = "state.json"
+TRACE_FILE = "trace.json"
+CHROME_TRACE_FILE = "trace.chrome.json"  # Open in chrome://tracing or ui.perfetto.dev
+SUMMARY_FILE = "summary.json"
+
+
+def _write_atomic(path, data):
+    """Writes bytes or text to path via a temporary file, so a crash never leaves a partial output."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(data.encode("utf-8") if isinstance(data, str) else data)
+    os.replace(tmp_path, path)
+
+
+class PaperJob:
+    """One paper's output folder and its per-stage checkpoint file.
+
+    The folder is <output_dir>/<name>-<hash>, unless an explicit directory is given (as the job
+    service does). on_event, if set, receives stage and progress events as they happen.
+    """
+
+    def __init__(self, pdf_path, output_dir, options, directory=None, on_event=None):
+        self.pdf_path = pdf_path
+        self.options = options
+        self.on_event = on_event
+        self.stage = None  # The stage running now, for progress events
+        with open(pdf_path, "rb") as f:
+            self.file_hash = file_hash(f.read())
+        name = os.path.splitext(os.path.basename(pdf_path))[0]
+        self.directory = directory or os.path.join(output_dir, f"{name}-{self.file_hash[:8]}")
+        os.makedirs(self.directory, exist_ok=True)
+        self.state = self._load_state()
+
+    def _load_state(self):
+        try:
+            with open(self.path(STATE_FILE), "r", encoding="utf-8") as f:
+                state = json.load(f)
+            if state.get("file_hash") == self.file_hash:
+                return state
+        except (OSError, ValueError):
+            pass
+        return {"source": self.pdf_path, "file_hash": self.file_hash, "stages": {}}
+
+    def save_state(self):
+        _write_atomic(self.path(STATE_FILE), json.dumps(self.state, indent=2))
+
+    def path(self, filename):
+        return os.path.join(self.directory, filename)
+
+    def write(self, filename, data):
+        _write_atomic(self.path(filename), data)
+        return filename
+
+    def read(self, filename):
+        with open(self.path(filename), "r", encoding="utf-8") as f:
+            return f.read()
+
+    def emit(self, event):
+        if self.on_event is not None:
+            self.on_event(event)
+
+    def progress(self, value):
+        """Reports how far the running stage has got (0-1); shaped like st.progress, so stages can pass the job."""
+        self.emit({"type": "progress", "stage": self.stage, "value": value})
+
+    def is_done(self, stage):
+        record = self.state["stages"].get(stage)
+        return (record is not None and record["status"] == "done"
+                and all(os.path.exists(self.path(output)) for output in record["outputs"]))
+
+
+# Stages. Each reads earlier stages' outputs from the paper folder and returns the files it wrote.
+# The Streamlit apps are imported lazily, so a run that skips a pipeline does not need its dependencies.
+
+def stage_podcast_script(job):
+    from Podcast import clean_text, condense_paper_text, generate_podcast_script
+
+    paper_text, token_report = condense_paper_text(clean_text(ingest_pdf(job.pdf_path).body_text))
+    script = generate_podcast_script(paper_text, job.options.remark)
+    return [job.write("podcast_script.txt", script),
+            job.write("podcast_token_report.json", json.dumps(token_report, indent=2))]
+
+
+def stage_podcast_audio(job):
+    from Podcast import audio_generation, format_script_for_murf
+
+    audio_bytes = audio_generation(format_script_for_murf(job.read("podcast_script.txt")),
+                                   progress_bar=job, max_workers=job.options.tts_workers)
+    if not audio_bytes:
+        raise RuntimeError("No podcast lines could be synthesized")
+    return [job.write("podcast.mp3", audio_bytes)]
+
+
+def stage_abstract(job):
+    from diagrams import render_workflow_png, render_workflow_svg
+    from GraphicalAbstract import (EXTRACTION_STAGES, condense_text, extract_text_from_pdf,
+                                   generate_graphical_abstract_svg, generate_mermaid_diagram, run_extraction_stages)
+
+    text = extract_text_from_pdf(job.pdf_path)
+    if not text:
+        raise RuntimeError("No text could be extracted")
+    paper_text, token_report = condense_text(text)
+    results, _ = run_extraction_stages(EXTRACTION_STAGES, paper_text)
+    workflow_text, components = results["workflow"], results["components"]
+    if not workflow_text or not components:
+        raise RuntimeError("Workflow or component extraction failed")
+    outputs = [job.write("workflow.txt", workflow_text), job.write("components.json", json.dumps(components, indent=2)),
+               job.write("abstract_token_report.json", json.dumps(token_report, indent=2))]
+    mermaid_code = generate_mermaid_diagram(workflow_text)
+    if mermaid_code:
+        outputs.append(job.write("workflow_diagram.mmd", mermaid_code))
+    diagram_svg = render_workflow_svg(workflow_text)
+    if diagram_svg:
+        outputs.append(job.write("workflow_diagram.svg", diagram_svg))
+        outputs.append(job.write("workflow_diagram.png", render_workflow_png(workflow_text)))
+    svg_code = generate_graphical_abstract_svg(components)
+    if svg_code:
+        outputs.append(job.write("graphical_abstract.svg", svg_code))
+    return outputs
+
+
+def stage_deck_slides(job):
+    from presentation import SUMMARY_QUERY, generate_contextual_summary, generate_slide_content, preprocess_slide_content
+    from section_index import ChunkIndex, chunk_document
+
+    paper = ingest_pdf(job.pdf_path)
+    chunk_index = ChunkIndex.load_or_build(paper.file_hash, chunk_document(paper))
+    summary = generate_contextual_summary(SUMMARY_QUERY, chunk_index)
+    slides = preprocess_slide_content(generate_slide_content(summary))
+    if not slides:
+        raise RuntimeError("Gemini returned no slides")
+    return [job.write("summary.txt", summary), job.write("slides.json", json.dumps(slides, indent=2))]
+
+
+def _paper_figure_index(job):
+    """Extracts the paper's figures and embeds them into the job's own index, once per job.
+
+    The deck and corpus stages both call this; the second caller finds every file unchanged
+    and reuses the stored vectors instead of running CLIP again.
+    """
+    from image_index import ImageIndex
+    from model_registry import get_model
+    from pdf_ingest import extract_figures
+
+    figures_dir = job.path("figures")
+    if not os.path.isdir(figures_dir):
+        extract_figures(job.pdf_path, figures_dir)
+    index = ImageIndex(job.path("image_faiss.index"), job.path("image_paths.txt"))
+    index.update(figures_dir, get_model("clip"))
+    return index
+
+
+def stage_deck(job):
+    from presentation import create_presentation
+    from workspace import Workspace
+
+    # Each paper gets its own figure folder and index, so decks only use their own paper's figures
+    index = _paper_figure_index(job)
+
+    slides = json.loads(job.read("slides.json"))
+    # The deck is built in scratch space inside the job folder, so a failed build leaves nothing behind
+    with Workspace("deck", root=job.directory) as scratch:
+        create_presentation(slides, template=job.options.template, output_filename=scratch.file("presentation.pptx"),
+                            index_path=index.index_path, paths_file=index.paths_file,
+                            related_paper_id=job.file_hash if job.options.related_figures else None)
+        os.replace(scratch.file("presentation.pptx"), job.path("presentation.pptx"))
+    return ["presentation.pptx"]
+
+
+def stage_corpus(job):
+    from corpus_index import add_paper_chunks, add_paper_figures
+    from section_index import chunk_document
+
+    # Figures and chunks join the library-wide indexes, keyed by the paper's content hash
+    paper = ingest_pdf(job.pdf_path)
+    # The per-paper index already leaves out logos, rules and repeated figures, and holds their vectors
+    figure_paths, embeddings = _paper_figure_index(job).vectors()
+    add_paper_figures(paper.file_hash, figure_paths, embeddings=embeddings)
+    add_paper_chunks(paper.file_hash, chunk_document(paper))
+    return []
+
+
+# Stage name -> (function, stages whose outputs it reads), in run order
+STAGES = {
+    "podcast_script": (stage_podcast_script, []),
+    "podcast_audio": (stage_podcast_audio, ["podcast_script"]),
+    "abstract": (stage_abstract, []),
+    "deck_slides": (stage_deck_slides, []),
+    "deck": (stage_deck, ["deck_slides"]),
+    "corpus": (stage_corpus, []),
+}
+STAGE_GROUPS = {"podcast": ["podcast_script", "podcast_audio"], "deck": ["deck_slides", "deck"]}
+
+
+def resolve_stages(names):
+    """Expands group names and adds every stage the requested ones depend on, in run order."""
+    wanted = set()
+    pending = [stage for name in names for stage in STAGE_GROUPS.get(name, [name])]
+    while pending:
+        stage = pending.pop()
+        if stage not in STAGES:
+            raise ValueError(f"Unknown stage: {stage}")
+        if stage not in wanted:
+            wanted.add(stage)
+            pending.extend(STAGES[stage][1])
+    return [stage for stage in STAGES if stage in wanted]
+
+
+def list_papers(source):
+    """Returns the PDF paths in a directory, or listed in a manifest file."""
+    if os.path.isdir(source):
+        return [os.path.join(source, name) for name in sorted(os.listdir(source)) if name.lower().endswith(".pdf")]
+    base = os.path.dirname(os.path.abspath(source))
+    with open(source, "r", encoding="utf-8") as f:
+        lines = [line.split("#", 1)[0].strip() for line in f]
+    return [os.path.join(base, line) for line in lines if line]
+
+
+def configure_apis(stages):
+    """Configures Gemini for the deck stages, which (unlike the podcast) do not configure it themselves."""
+    if any(stage.startswith("deck") for stage in stages):
+        import google.generativeai as genai
+        genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+
+
+def run_stages(job, stages):
+    """Runs the job's unfinished stages in order and returns {stage: record} for this run."""
+    trace = Trace(os.path.basename(job.directory))
+    records = {}
+    with trace.activate():
+        for stage in stages:
+            function, dependencies = STAGES[stage]
+            if job.is_done(stage):
+                records[stage] = {"status": "skipped"}
+                job.emit({"type": "stage", "stage": stage, "status": "skipped"})
+                continue
+            if not all(job.is_done(dependency) for dependency in dependencies):
+                records[stage] = {"status": "blocked"}
+                job.emit({"type": "stage", "stage": stage, "status": "blocked"})
+                continue
+            job.stage = stage
+            job.emit({"type": "stage", "stage": stage, "status": "running"})
+            start = time.perf_counter()
+            try:
+                with span(f"stage.{stage}"):
+                    outputs = function(job)
+                record = {"status": "done", "outputs": outputs}
+            except Exception as e:
+                print(f"❌ {os.path.basename(job.pdf_path)}: {stage} failed: {e}")
+                record = {"status": "failed", "outputs": [], "error": str(e)}
+            record["seconds"] = time.perf_counter() - start
+            record["finished_at"] = time.time()
+            # Checkpoint after every stage, so a crash loses at most the stage that was running
+            job.state["stages"][stage] = record
+            job.save_state()
+            records[stage] = record
+            job.emit({"type": "stage", "stage": stage, **record})
+        job.stage = None
+    if trace.spans:
+        # Only this run's stages; a resumed run overwrites the trace of the run before it
+        trace.save_json(job.path(TRACE_FILE))
+        trace.save_chrome_trace(job.path(CHROME_TRACE_FILE))
+    return records
+
+
+def run_paper(pdf_path, stages, options):
+    """Runs the paper's unfinished stages in order and returns {stage: record} for this run."""
+    return run_stages(PaperJob(pdf_path, options.output, options), stages)
+
+
+def summarize_run(results, stages, wall_seconds):
+    """Builds the throughput summary from {pdf_path: {stage: record}}."""
+    stage_summary = {}
+    for stage in stages:
+        records = [paper_records[stage] for paper_records in results.values() if stage in paper_records]
+        done = [record for record in records if record["status"] == "done"]
+        seconds = sum(record.get("seconds", 0.0) for record in records)
+        stage_summary[stage] = {
+            "done": len(done),
+            "skipped": sum(record["status"] == "skipped" for record in records),
+            "failed": sum(record["status"] == "failed" for record in records),
+            "blocked": sum(record["status"] == "blocked" for record in records),
+            "seconds": seconds,
+            "mean_seconds": seconds / len(done) if done else 0.0,
+        }
+    complete = [path for path, records in results.items()
+                if records and all(record["status"] in ("done", "skipped") for record in records.values())]
+    return {
+        "papers": len(results),
+        "complete": len(complete),
+        "incomplete": len(results) - len(complete),
+        "wall_seconds": wall_seconds,
+        "papers_per_hour": len(complete) / wall_seconds * 3600 if wall_seconds else 0.0,
+        "stages": stage_summary,
+        "rate_limits": rate_limit_stats(),
+        "llm_cache": get_llm_cache().stats(),
+    }
+
+
+def print_summary(summary):
+    print(f"\n{summary['complete']}/{summary['papers']} papers complete in {summary['wall_seconds']:.1f}s "
+          f"({summary['papers_per_hour']:.1f} papers/hour)")
+    for stage, stats in summary["stages"].items():
+        print(f"  {stage:15} {stats['done']:4} done {stats['skipped']:4} resumed {stats['failed']:4} failed "
+              f"{stats['blocked']:4} blocked  {stats['seconds']:8.1f}s total  {stats['mean_seconds']:6.1f}s mean")
+    for name, stats in summary["rate_limits"].items():
+        print(f"  {name} limit: {stats['calls']} calls, {stats['waited_seconds']:.1f}s waiting")
+    cache = summary["llm_cache"]
+    print(f"  LLM cache: {cache['hits']} hits / {cache['misses']} misses")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source", help="Directory of PDFs or a manifest file listing them")
+    parser.add_argument("--output", default="batch_output", help="Folder for results and checkpoints")
+    parser.add_argument("--stages", nargs="+", default=list(STAGES),
+                        help=f"Stages or groups to run: {', '.join(list(STAGES) + list(STAGE_GROUPS))}")
+    parser.add_argument("--workers", type=int, default=BATCH_WORKERS, help="Papers processed concurrently")
+    parser.add_argument("--tts-workers", type=int, default=4, help="Concurrent TTS requests per paper")
+    parser.add_argument("--llm-rpm", type=float, default=None, help="LLM requests per minute across all workers")
+    parser.add_argument("--tts-rpm", type=float, default=None, help="TTS requests per minute across all workers")
+    parser.add_argument("--remark", default="", help="Customization remark for the podcast script")
+    parser.add_argument("--template", default="LIGHT", choices=["LIGHT", "DARK", "FUN"])
+    parser.add_argument("--related-figures", action="store_true",
+                        help="Fill deck slides that have no figure with related figures from the corpus")
+    args = parser.parse_args()
+
+    try:
+        stages = resolve_stages(args.stages)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.llm_rpm is not None:
+        set_rate_limit("llm", args.llm_rpm)
+    if args.tts_rpm is not None:
+        set_rate_limit("tts", args.tts_rpm)
+    configure_apis(stages)
+
+    papers = list_papers(args.source)
+    if not papers:
+        print(f"No PDFs found in {args.source}")
+        return 1
+    os.makedirs(args.output, exist_ok=True)
+    print(f"Processing {len(papers)} papers with {args.workers} workers: {', '.join(stages)}")
+
+    results = {}
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        futures = {executor.submit(run_paper, path, stages, args): path for path in papers}
+        for finished, future in enumerate(as_completed(futures), start=1):
+            path = futures[future]
+            try:
+                records = future.result()
+            except Exception as e:  # e.g. an unreadable file; the other papers carry on
+                print(f"❌ {os.path.basename(path)}: {e}")
+                records = {}
+            results[path] = records
+            statuses = ", ".join(f"{stage}={record['status']}" for stage, record in records.items())
+            print(f"[{finished}/{len(papers)}] {os.path.basename(path)}: {statuses or 'failed'}")
+
+    summary = summarize_run(results, stages, time.perf_counter() - start)
+    _write_atomic(os.path.join(args.output, SUMMARY_FILE), json.dumps(summary, indent=2))
+    print_summary(summary)
+    return 0 if summary["incomplete"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
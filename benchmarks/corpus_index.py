@@ -0,0 +1,118 @@
+"""Compares the approximate corpus indexes (IVF, IVF-PQ, HNSW) with an exact flat index.
+
+Reports build time, size on disk, load time (full read vs memory-mapped), recall@k against the
+flat index and per-query latency, with and without a paper-ID filter.
+
+Usage:
+    python benchmarks/corpus_index.py --vectors 100000 --dim 512
+    python benchmarks/corpus_index.py --vectors 20000 --dim 384 --nprobe 4 16 64
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import faiss
+import numpy as np
+
+import corpus_index
+from corpus_index import _index_spec
+
+
+def make_vectors(count, dim, clusters, rng):
+    """Normalised vectors drawn around random centres, roughly like embeddings of related papers."""
+    centres = rng.normal(size=(clusters, dim)).astype("float32")
+    vectors = centres[rng.integers(0, clusters, count)] + 0.6 * rng.normal(size=(count, dim)).astype("float32")
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+def recall(approx_ids, exact_ids):
+    hits = sum(len(set(a[a != -1]) & set(e[e != -1])) for a, e in zip(approx_ids, exact_ids))
+    return hits / max(sum((e != -1).sum() for e in exact_ids), 1)
+
+
+def timed_search(index, queries, top_k, params=None):
+    """Searches one query at a time, as an interactive request would; returns ids and latencies (ms)."""
+    ids, latencies = [], []
+    for query in queries:
+        start = time.perf_counter()
+        _, row = index.search(query[None, :], top_k, params=params)
+        latencies.append((time.perf_counter() - start) * 1000)
+        ids.append(row[0])
+    return np.array(ids), np.array(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vectors", type=int, default=50000)
+    parser.add_argument("--dim", type=int, default=512, help="512 for CLIP figures, 384 for MiniLM chunks")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--papers", type=int, default=2000, help="Papers the vectors are spread over, for filtering")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[corpus_index.NPROBE])
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[corpus_index.EF_SEARCH])
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    vectors = make_vectors(args.vectors, args.dim, max(args.vectors // 500, 8), rng)
+    queries = make_vectors(args.queries, args.dim, max(args.vectors // 500, 8), rng)
+    ids = np.arange(args.vectors, dtype="int64")
+    paper_of = rng.integers(0, args.papers, args.vectors)
+    # Filtered queries only look at 1% of the papers, like "figures from these related papers"
+    allowed = ids[np.isin(paper_of, rng.choice(args.papers, max(args.papers // 100, 1), replace=False))]
+    selector = faiss.IDSelectorBatch(allowed)
+
+    flat = faiss.IndexIDMap2(faiss.IndexFlatIP(args.dim))
+    flat.add_with_ids(vectors, ids)
+    exact_ids, flat_latency = timed_search(flat, queries, args.top_k)
+    exact_filtered, _ = timed_search(flat, queries, args.top_k, faiss.SearchParameters(sel=selector))
+    print(f"{args.vectors} vectors x {args.dim} dims, {args.queries} queries, top {args.top_k}; "
+          f"filtered queries see {len(allowed)} vectors")
+    print(f"{'index':28} {'build s':>8} {'MB':>7} {'load ms':>8} {'mmap ms':>8} {'recall':>7} "
+          f"{'p50 ms':>7} {'p95 ms':>7} {'filt recall':>11} {'filt p50':>8}")
+    print(f"{'Flat (exact)':28} {'':>8} {flat.ntotal * args.dim * 4 / 2**20:7.1f} {'':>8} {'':>8} {1.0:7.3f} "
+          f"{np.percentile(flat_latency, 50):7.3f} {np.percentile(flat_latency, 95):7.3f}")
+
+    directory = tempfile.mkdtemp()
+    for index_type in ("ivf", "ivfpq", "hnsw"):
+        spec = _index_spec(index_type, args.dim, args.vectors)
+        start = time.perf_counter()
+        index = faiss.index_factory(args.dim, spec, faiss.METRIC_INNER_PRODUCT)
+        index.train(vectors)
+        index.add_with_ids(vectors, ids)
+        build_seconds = time.perf_counter() - start
+
+        path = os.path.join(directory, f"{index_type}.faiss")
+        faiss.write_index(index, path)
+        start = time.perf_counter()
+        faiss.read_index(path)
+        load_ms = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        index = faiss.read_index(path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        mmap_ms = (time.perf_counter() - start) * 1000
+
+        settings = args.ef_search if index_type == "hnsw" else args.nprobe
+        for setting in settings:
+            if index_type == "hnsw":
+                label = f"{spec} ef={setting}"
+                params = faiss.SearchParametersHNSW(efSearch=setting)
+                filtered_params = faiss.SearchParametersHNSW(sel=selector, efSearch=max(setting, 512))
+            else:
+                label = f"{spec} nprobe={setting}"
+                params = faiss.SearchParametersIVF(nprobe=setting)
+                # Mirrors CorpusIndex: narrow filters scan every list
+                filtered_params = faiss.SearchParametersIVF(sel=selector, nprobe=index.nlist)
+            approx_ids, latency = timed_search(index, queries, args.top_k, params)
+            filtered_ids, filtered_latency = timed_search(index, queries, args.top_k, filtered_params)
+            print(f"{label:28} {build_seconds:8.2f} {os.path.getsize(path) / 2**20:7.1f} {load_ms:8.1f} {mmap_ms:8.1f} "
+                  f"{recall(approx_ids, exact_ids):7.3f} {np.percentile(latency, 50):7.3f} "
+                  f"{np.percentile(latency, 95):7.3f} {recall(filtered_ids, exact_filtered):11.3f} "
+                  f"{np.percentile(filtered_latency, 50):8.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Compares serial and page-parallel PDF text extraction.
+
+Usage:
+    python benchmarks/pdf_extraction.py thesis.pdf proceedings.pdf --workers 2 4 8
+    python benchmarks/pdf_extraction.py --synthetic-pages 300
+"""
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fitz  # PyMuPDF
+import PyPDF2
+
+from pdf_ingest import extract_page_texts
+
+
+def legacy_pymupdf(data):
+    """The original extract_text_pymupdf loop: one core, repeated string concatenation."""
+    doc = fitz.open(stream=data, filetype="pdf")
+    text = ""
+    for page in doc:
+        text += page.get_text()
+    return text
+
+
+def legacy_pypdf2(data):
+    """The original extract_text_pypdf2 loop."""
+    reader = PyPDF2.PdfReader(io.BytesIO(data))
+    text = ""
+    for i in range(len(reader.pages)):
+        text += reader.pages[i].extract_text()
+    return text
+
+
+def make_synthetic_pdf(page_count):
+    """Writes a text-heavy PDF with the given number of pages and returns its path."""
+    doc = fitz.open()
+    paragraph = "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 12
+    for i in range(page_count):
+        page = doc.new_page()
+        page.insert_textbox(fitz.Rect(50, 50, 550, 800), f"Page {i + 1}\n" + paragraph * 8, fontsize=9)
+    path = os.path.join(tempfile.mkdtemp(), f"synthetic_{page_count}.pdf")
+    doc.save(path)
+    return path
+
+
+def best_of(repeat, fn, *args):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pdfs", nargs="*", help="PDF files to benchmark")
+    parser.add_argument("--synthetic-pages", type=int, default=300,
+                        help="Pages in the generated PDF used when no files are given")
+    parser.add_argument("--workers", type=int, nargs="+", default=[2, 4, os.cpu_count() or 1])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--include-pypdf2", action="store_true", help="Also benchmark the PyPDF2 backend (slow)")
+    args = parser.parse_args()
+
+    pdfs = args.pdfs or [make_synthetic_pdf(args.synthetic_pages)]
+    backends = ["pymupdf", "pypdf2"] if args.include_pypdf2 else ["pymupdf"]
+    legacy = {"pymupdf": legacy_pymupdf, "pypdf2": legacy_pypdf2}
+
+    for path in pdfs:
+        with open(path, "rb") as f:
+            data = f.read()
+        page_count = len(fitz.open(stream=data, filetype="pdf"))
+        print(f"\n{os.path.basename(path)} ({page_count} pages)")
+        for backend in backends:
+            baseline = best_of(args.repeat, legacy[backend], data)
+            print(f"  {backend:8} legacy serial        {baseline:8.3f}s")
+            serial = best_of(args.repeat, extract_page_texts, data, backend, 1)
+            print(f"  {backend:8} serial               {serial:8.3f}s  x{baseline / serial:.2f}")
+            for workers in sorted(set(args.workers)):
+                # Force the pool even below PARALLEL_MIN_PAGES so small files are still comparable
+                parallel = best_of(args.repeat, _parallel, data, backend, workers)
+                print(f"  {backend:8} parallel ({workers:2} proc)  {parallel:8.3f}s  x{baseline / parallel:.2f}")
+
+
+def _parallel(data, backend, workers):
+    import pdf_ingest
+    min_pages = pdf_ingest.PARALLEL_MIN_PAGES
+    pdf_ingest.PARALLEL_MIN_PAGES = 0
+    try:
+        return extract_page_texts(data, backend, workers)
+    finally:
+        pdf_ingest.PARALLEL_MIN_PAGES = min_pages
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+"""Library-wide approximate indexes over figure (CLIP) and passage (MiniLM) embeddings from many papers.
+
+Unlike the per-paper SectionIndex/ChunkIndex and ImageIndex, a corpus index holds every paper
+added to it, so a deck can pull in a related figure or passage from prior work. Vectors live in
+a FAISS IVF(-PQ) or HNSW index; which paper each vector came from, and what it points to, lives
+in a SQLite table next to it, so searches can be restricted to (or exclude) given papers.
+
+One process should write to a corpus at a time; any number may open it read-only (memory-mapped).
+"""
+import json
+import math
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+import faiss
+import numpy as np
+
+from tracing import span
+
+CORPUS_INDEX_DIR = os.getenv("CORPUS_INDEX_DIR", ".corpus_index")
+DEFAULT_INDEX_TYPE = "ivfpq"  # "ivfpq" (compressed), "ivf" (uncompressed lists) or "hnsw" (graph, no training)
+TRAIN_MIN_VECTORS = 10000  # IVF corpora stay exact (flat) until this many vectors are available to train on
+NPROBE = 16  # IVF lists scanned per query
+EF_SEARCH = 64  # HNSW candidate list size per query
+HNSW_NEIGHBOURS = 32
+SELECTIVE_FILTER_IDS = 5000  # Filters allowing fewer vectors than this scan every list, so they still find top_k
+
+
+def _index_spec(index_type, dim, count):
+    """FAISS factory string for an index over count vectors of size dim."""
+    if index_type == "hnsw":
+        return f"IDMap2,HNSW{HNSW_NEIGHBOURS}"
+    # About 4 * sqrt(n) lists, with at least 39 training points per list as FAISS recommends
+    nlist = max(16, min(int(4 * math.sqrt(count)), count // 39))
+    if index_type == "ivfpq":
+        # 8 dimensions per sub-quantizer: 64 bytes per CLIP vector instead of 2 KB
+        return f"IVF{nlist},PQ{max(d for d in range(1, dim // 8 + 1) if dim % d == 0)}"
+    if index_type == "ivf":
+        return f"IVF{nlist},Flat"
+    raise ValueError(f"Unknown corpus index type: {index_type}")
+
+
+class CorpusIndex:
+    """A persistent ANN index over many papers' embeddings, with per-paper metadata filtering.
+
+    IVF corpora start as an exact flat index and are trained into IVF once TRAIN_MIN_VECTORS
+    vectors exist; later papers are added incrementally to the trained lists. Embeddings must be
+    L2-normalised, so inner-product scores are cosine similarities.
+    """
+
+    def __init__(self, name, model_name, index_type=DEFAULT_INDEX_TYPE, directory=CORPUS_INDEX_DIR, read_only=False):
+        self.name = name
+        self.model_name = model_name
+        self.read_only = read_only
+        self.directory = os.path.join(directory, name)
+        self.index_path = os.path.join(self.directory, "index.faiss")
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(os.path.join(self.directory, "meta.sqlite3"), check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS config (key TEXT PRIMARY KEY, value TEXT)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS papers (paper_id TEXT PRIMARY KEY, added_at REAL, count INTEGER)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS entries (id INTEGER PRIMARY KEY, paper_id TEXT, payload TEXT)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS entries_paper ON entries (paper_id)")
+        config = dict(self._conn.execute("SELECT key, value FROM config").fetchall())
+        if config.get("model", model_name) != model_name:
+            raise ValueError(f"Corpus {name} holds {config['model']} embeddings, not {model_name}")
+        self.index_type = config.get("index_type", index_type)
+        self.index = None
+        self._index_mtime = None
+        if os.path.exists(self.index_path):
+            self._load_index()
+
+    def _load_index(self):
+        # Read-only opens map the file instead of loading it, so many processes share one copy in the page cache
+        flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY if self.read_only else 0
+        # Stat first: if a writer replaces the file while it is read, the next refresh() picks that up
+        self._index_mtime = os.stat(self.index_path).st_mtime_ns
+        self.index = faiss.read_index(self.index_path, flags)
+
+    def refresh(self):
+        """Maps the index again if a writer has saved a newer one since; returns True if it did.
+
+        Only read-only handles need this: the metadata is queried from SQLite on every search,
+        so it is always current, but the mapped index is a snapshot of the file when it was opened.
+        """
+        if not self.read_only:
+            return False
+        try:
+            mtime = os.stat(self.index_path).st_mtime_ns
+        except FileNotFoundError:
+            return False
+        with self._lock:
+            if mtime == self._index_mtime:
+                return False
+            self._load_index()
+        return True
+
+    @property
+    def ntotal(self):
+        return self.index.ntotal if self.index is not None else 0
+
+    @property
+    def trained(self):
+        """True once the index is approximate (HNSW, or IVF after training)."""
+        if self.index is None:
+            return False
+        return not (isinstance(self.index, faiss.IndexIDMap2)
+                    and isinstance(faiss.downcast_index(self.index.index), faiss.IndexFlat))
+
+    def has_paper(self, paper_id):
+        return self._conn.execute("SELECT 1 FROM papers WHERE paper_id = ?", (paper_id,)).fetchone() is not None
+
+    def paper_ids(self):
+        return [row[0] for row in self._conn.execute("SELECT paper_id FROM papers ORDER BY added_at")]
+
+    def _ids_for(self, paper_ids):
+        placeholders = ",".join("?" * len(paper_ids))
+        rows = self._conn.execute(f"SELECT id FROM entries WHERE paper_id IN ({placeholders})", list(paper_ids))
+        return np.array([row[0] for row in rows], dtype="int64")
+
+    def add(self, paper_id, embeddings, payloads):
+        """Adds one paper's vectors and their payloads (JSON-serialisable dicts); returns False if it is already in."""
+        if self.read_only:
+            raise RuntimeError(f"Corpus {self.name} was opened read-only")
+        embeddings = np.ascontiguousarray(embeddings, dtype="float32")
+        if embeddings.ndim != 2 or not len(embeddings):
+            raise ValueError("add() needs a 2-D array with at least one embedding")
+        with self._lock:
+            if self.has_paper(paper_id):
+                return False
+            # Vectors are never removed, so ids run 0..ntotal-1. The index is saved before the metadata
+            # commit; after a crash in between, the orphaned vectors simply have no entry and are skipped.
+            ids = np.arange(self.ntotal, self.ntotal + len(embeddings), dtype="int64")
+            with span("corpus.add", corpus=self.name, items=len(ids)):
+                if self.index is None:
+                    spec = _index_spec(self.index_type, embeddings.shape[1], 0) if self.index_type == "hnsw" else "IDMap2,Flat"
+                    self.index = faiss.index_factory(embeddings.shape[1], spec, faiss.METRIC_INNER_PRODUCT)
+                self.index.add_with_ids(embeddings, ids)
+                if not self.trained and self.ntotal >= TRAIN_MIN_VECTORS:
+                    self._train()
+            self.save()
+            with self._conn:
+                self._conn.executemany("INSERT INTO entries (id, paper_id, payload) VALUES (?, ?, ?)",
+                                       [(int(i), paper_id, json.dumps(payload)) for i, payload in zip(ids, payloads)])
+                self._conn.execute("INSERT INTO papers (paper_id, added_at, count) VALUES (?, ?, ?)",
+                                   (paper_id, time.time(), len(ids)))
+                self._conn.executemany("INSERT OR REPLACE INTO config (key, value) VALUES (?, ?)",
+                                       [("model", self.model_name), ("index_type", self.index_type)])
+        return True
+
+    def _train(self):
+        """Replaces the exact index with an IVF index trained on every vector added so far."""
+        flat = self.index
+        ids = faiss.vector_to_array(flat.id_map).astype("int64")
+        vectors = flat.index.reconstruct_n(0, flat.ntotal)
+        spec = _index_spec(self.index_type, vectors.shape[1], len(vectors))
+        with span("corpus.train", corpus=self.name, spec=spec, items=len(vectors)):
+            index = faiss.index_factory(vectors.shape[1], spec, faiss.METRIC_INNER_PRODUCT)
+            index.train(vectors)
+            index.add_with_ids(vectors, ids)
+        print(f"Trained {self.name} corpus index as {spec} on {len(vectors)} vectors")
+        self.index = index
+
+    def save(self):
+        with self._lock:
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            os.close(fd)
+            faiss.write_index(self.index, tmp_path)
+            os.replace(tmp_path, self.index_path)
+
+    def _search_params(self, selector, selected):
+        if isinstance(self.index, faiss.IndexIVF):
+            # A narrow filter may have no vectors in the nearest lists, so it scans all of them
+            nprobe = self.index.nlist if selected is not None and selected < SELECTIVE_FILTER_IDS else NPROBE
+            return faiss.SearchParametersIVF(sel=selector, nprobe=nprobe)
+        if self.index_type == "hnsw":
+            # Likewise, widen the graph search so enough allowed vectors are visited
+            ef = max(EF_SEARCH, 512) if selected is not None and selected < SELECTIVE_FILTER_IDS else EF_SEARCH
+            return faiss.SearchParametersHNSW(sel=selector, efSearch=ef)
+        return faiss.SearchParameters(sel=selector) if selector is not None else None
+
+    def search(self, query_embeddings, top_k=5, paper_ids=None, exclude_paper_ids=None):
+        """Returns, per query, up to top_k (score, entry) pairs; entry is the payload plus id and paper_id.
+
+        paper_ids restricts results to those papers; exclude_paper_ids drops them (e.g. the paper
+        the deck is about, when looking for related prior work).
+        """
+        query_embeddings = np.ascontiguousarray(query_embeddings, dtype="float32")
+        if self.ntotal == 0:
+            return [[] for _ in range(len(query_embeddings))]
+        with self._lock:
+            selector, selected = None, None
+            if paper_ids is not None:
+                allowed = self._ids_for(paper_ids)
+                selector, selected = faiss.IDSelectorBatch(allowed), len(allowed)
+            elif exclude_paper_ids:
+                excluded = faiss.IDSelectorBatch(self._ids_for(exclude_paper_ids))
+                selector = faiss.IDSelectorNot(excluded)
+            with span("corpus.search", corpus=self.name, queries=len(query_embeddings)):
+                params = self._search_params(selector, selected)
+                scores, ids = self.index.search(query_embeddings, min(top_k, self.ntotal), params=params)
+
+            found = {int(i) for row in ids for i in row if i != -1}
+            entries = {}
+            if found:
+                placeholders = ",".join("?" * len(found))
+                for entry_id, paper_id, payload in self._conn.execute(
+                        f"SELECT id, paper_id, payload FROM entries WHERE id IN ({placeholders})", list(found)):
+                    entries[entry_id] = {**json.loads(payload), "id": entry_id, "paper_id": paper_id}
+        return [[(float(score), entries[int(i)]) for score, i in zip(row_scores, row_ids) if int(i) in entries]
+                for row_scores, row_ids in zip(scores, ids)]
+
+
+_corpora = {}
+_corpora_lock = threading.Lock()
+
+
+def get_corpus(name, read_only=False):
+    """Returns the shared "figures" (CLIP) or "chunks" (MiniLM) corpus index for this process.
+
+    Read-only handles are refreshed on every call, so they see papers added since they were opened.
+    """
+    models = {"figures": "clip", "chunks": "minilm"}
+    with _corpora_lock:
+        key = (name, read_only)
+        if key not in _corpora:
+            _corpora[key] = CorpusIndex(name, models[name], read_only=read_only)
+        corpus = _corpora[key]
+    corpus.refresh()
+    return corpus
+
+
+def add_paper_figures(paper_id, figure_paths, corpus=None, embeddings=None):
+    """Adds a paper's figures to the figure corpus (once per paper), embedding them with CLIP unless
+    their embeddings (one row per path, e.g. from ImageIndex.vectors) are passed in."""
+    from image_index import embed_images
+    from model_registry import get_model
+
+    corpus = corpus or get_corpus("figures")
+    if corpus.has_paper(paper_id) or not figure_paths:
+        return False
+    if embeddings is None:
+        embeddings = embed_images(get_model("clip"), list(figure_paths))
+    return corpus.add(paper_id, embeddings, [{"path": os.path.abspath(path)} for path in figure_paths])
+
+
+def add_paper_chunks(paper_id, chunks, corpus=None):
+    """Embeds a paper's chunks (see section_index.chunk_document) with MiniLM and adds them to the chunk corpus."""
+    from model_registry import get_model
+
+    corpus = corpus or get_corpus("chunks")
+    if corpus.has_paper(paper_id) or not chunks:
+        return False
+    embeddings = get_model("minilm").encode([chunk["text"] for chunk in chunks], convert_to_numpy=True,
+                                            normalize_embeddings=True)
+    return corpus.add(paper_id, embeddings, [{key: chunk[key] for key in ("section", "page", "text")} for chunk in chunks])
+
+
+def search_corpus(name, queries, top_k=5, paper_ids=None, exclude_paper_ids=None, corpus=None):
+    """Encodes text queries with the corpus's model and searches it; see CorpusIndex.search."""
+    from model_registry import get_model
+
+    corpus = corpus or get_corpus(name, read_only=True)
+    query_embeddings = get_model(corpus.model_name).encode(list(queries), convert_to_numpy=True,
+                                                           normalize_embeddings=True)
+    return corpus.search(query_embeddings, top_k, paper_ids, exclude_paper_ids)
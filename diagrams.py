@@ -0,0 +1,294 @@
+"""Offline rendering of the workflow diagram to SVG and PNG, in the graphical abstract's visual style.
+
+The workflow text from extract_workflow() is a chain of `stepN[Label] --> stepM[Label]` lines.
+It is parsed and laid out top-down here, so no browser or Mermaid CDN is needed. This works in
+air-gapped deployments and in batch runs.
+
+Usage:
+    python diagrams.py batch_output/*/workflow.txt --format svg png
+"""
+import argparse
+import io
+import os
+import re
+import textwrap
+from xml.sax.saxutils import escape
+
+# Shared <defs> of the generated SVGs: drop shadow and section gradients
+SVG_DEFS = '''<defs>
+                <filter id="shadow" x="-20%" y="-20%" width="140%" height="140%">
+                    <feGaussianBlur in="SourceAlpha" stdDeviation="4"/>
+                    <feOffset dx="3" dy="3"/>
+                    <feComponentTransfer>
+                        <feFuncA type="linear" slope="0.3"/>
+                    </feComponentTransfer>
+                    <feMerge>
+                        <feMergeNode/>
+                        <feMergeNode in="SourceGraphic"/>
+                    </feMerge>
+                </filter>
+
+                <linearGradient id="headerGrad" x1="0%" y1="0%" x2="100%" y2="0%">
+                    <stop offset="0%" style="stop-color:#2196F3;stop-opacity:1" />
+                    <stop offset="100%" style="stop-color:#1976D2;stop-opacity:1" />
+                </linearGradient>
+
+                <linearGradient id="methodGrad" x1="0%" y1="0%" x2="100%" y2="0%">
+                    <stop offset="0%" style="stop-color:#E3F2FD;stop-opacity:1" />
+                    <stop offset="100%" style="stop-color:#BBDEFB;stop-opacity:1" />
+                </linearGradient>
+
+                <linearGradient id="findingGrad" x1="0%" y1="0%" x2="100%" y2="0%">
+                    <stop offset="0%" style="stop-color:#E8F5E9;stop-opacity:1" />
+                    <stop offset="100%" style="stop-color:#C8E6C9;stop-opacity:1" />
+                </linearGradient>
+
+                <linearGradient id="applicationGrad" x1="0%" y1="0%" x2="100%" y2="0%">
+                    <stop offset="0%" style="stop-color:#FFF3E0;stop-opacity:1" />
+                    <stop offset="100%" style="stop-color:#FFE0B2;stop-opacity:1" />
+                </linearGradient>
+            </defs>'''
+
+# Workflow diagram layout (SVG user units, i.e. pixels at scale 1)
+NODE_WIDTH = 280
+NODE_PADDING = 18  # Above and below the label
+NODE_RADIUS = 15  # Rounded corners, as in the graphical abstract boxes
+LINE_HEIGHT = 20
+FONT_SIZE = 16
+WRAP_CHARS = 28  # Characters per label line that fit NODE_WIDTH at FONT_SIZE
+RANK_GAP = 60  # Vertical space between consecutive steps, where the arrows go
+NODE_GAP = 40  # Horizontal space between steps on the same rank
+MARGIN = 40
+LOOP_OFFSET = 30  # How far right of the diagram edges back to earlier steps are routed
+
+NODE_GRADIENT = ("#E3F2FD", "#BBDEFB")  # methodGrad
+EDGE_COLOR = "#64B5F6"
+TEXT_COLOR = "#37474F"
+BACKGROUND = "#FFFFFF"
+PNG_SCALE = 2  # PNGs are drawn at twice the SVG size so they stay sharp on slides
+FONT_FILES = ("DejaVuSans.ttf", "Arial.ttf", "arial.ttf", "LiberationSans-Regular.ttf")
+
+STEP_PATTERN = re.compile(r'step(\d+)\[(.*?)\]', re.IGNORECASE)
+
+
+def parse_workflow(workflow_text):
+    """Returns ({step number: label}, [(source, target)]) from `stepN[Label] --> stepM[Label]` lines."""
+    nodes, edges = {}, []
+    for line in workflow_text.split('\n'):
+        parts = line.split('-->')
+        if len(parts) != 2:
+            continue
+        source_match = STEP_PATTERN.search(parts[0])
+        target_match = STEP_PATTERN.search(parts[1])
+        if not (source_match and target_match):
+            continue
+        source, target = int(source_match.group(1)), int(target_match.group(1))
+        nodes.setdefault(source, source_match.group(2).strip())
+        nodes.setdefault(target, target_match.group(2).strip())
+        if (source, target) not in edges:
+            edges.append((source, target))
+    return dict(sorted(nodes.items())), edges
+
+
+def layout_workflow(nodes, edges):
+    """Places each step in a top-down layer after its predecessors.
+
+    Returns {"width", "height", "nodes": {step: {x, y, width, height, lines}},
+    "edges": [[(x, y) polyline points]]}. Both renderers draw from this layout.
+    """
+    # Edges to a higher step number go down a rank; the rest loop back and do not affect ranks
+    ranks = {}
+    for step in nodes:
+        ranks[step] = max((ranks[source] + 1 for source, target in edges if target == step and source < step),
+                          default=0)
+    layers = {}
+    for step, rank in ranks.items():
+        layers.setdefault(rank, []).append(step)
+
+    widest = max((len(steps) for steps in layers.values()), default=1)
+    content_width = widest * NODE_WIDTH + (widest - 1) * NODE_GAP
+    placed, y = {}, MARGIN
+    for rank in sorted(layers):
+        steps = layers[rank]
+        boxes = {step: textwrap.wrap(nodes[step], width=WRAP_CHARS) or [""] for step in steps}
+        height = max(len(lines) for lines in boxes.values()) * LINE_HEIGHT + 2 * NODE_PADDING
+        row_width = len(steps) * NODE_WIDTH + (len(steps) - 1) * NODE_GAP
+        x = MARGIN + (content_width - row_width) / 2
+        for step in steps:
+            placed[step] = {"x": x, "y": y, "width": NODE_WIDTH, "height": height, "lines": boxes[step]}
+            x += NODE_WIDTH + NODE_GAP
+        y += height + RANK_GAP
+
+    has_loops = any(source >= target for source, target in edges)
+    loop_x = MARGIN + content_width + LOOP_OFFSET
+    routes = []
+    for source, target in edges:
+        a, b = placed[source], placed[target]
+        if source < target:
+            routes.append([(a["x"] + a["width"] / 2, a["y"] + a["height"]), (b["x"] + b["width"] / 2, b["y"])])
+        else:
+            # Back to an earlier (or the same) step: down into the gap below, round the right of the
+            # diagram and in from above, right of centre so it stays clear of the forward arrows
+            start_x, end_x = a["x"] + a["width"] * 0.75, b["x"] + b["width"] * 0.75
+            below, above = a["y"] + a["height"] + RANK_GAP / 2, b["y"] - RANK_GAP / 2
+            routes.append([(start_x, a["y"] + a["height"]), (start_x, below), (loop_x, below),
+                           (loop_x, above), (end_x, above), (end_x, b["y"])])
+
+    width = MARGIN * 2 + content_width + (LOOP_OFFSET * 2 if has_loops else 0)
+    height = max(y - RANK_GAP + MARGIN, MARGIN * 2)
+    return {"width": width, "height": height, "nodes": placed, "edges": routes}
+
+
+def _arrow_head(points, size=10):
+    """Returns the triangle at the end of a polyline, pointing along its last segment."""
+    (x0, y0), (x1, y1) = points[-2], points[-1]
+    length = max(((x1 - x0) ** 2 + (y1 - y0) ** 2) ** 0.5, 1e-6)
+    dx, dy = (x1 - x0) / length, (y1 - y0) / length
+    return [(x1, y1), (x1 - size * dx + size * 0.5 * dy, y1 - size * dy - size * 0.5 * dx),
+            (x1 - size * dx - size * 0.5 * dy, y1 - size * dy + size * 0.5 * dx)]
+
+
+def _shorten(points, size=10):
+    """The last polyline point pulled back by the arrow head, so the line does not poke through its tip."""
+    (x0, y0), (x1, y1) = points[-2], points[-1]
+    length = max(((x1 - x0) ** 2 + (y1 - y0) ** 2) ** 0.5, 1e-6)
+    return (x1 - size * (x1 - x0) / length, y1 - size * (y1 - y0) / length)
+
+
+def render_workflow_svg(workflow_text):
+    """Renders the workflow as a standalone SVG string, or returns None if it has no steps."""
+    nodes, edges = parse_workflow(workflow_text)
+    if not nodes:
+        return None
+    layout = layout_workflow(nodes, edges)
+
+    elements = []
+    for points in layout["edges"]:
+        path = " L ".join(f"{x:.1f} {y:.1f}" for x, y in points[:-1] + [_shorten(points)])
+        head = " ".join(f"{x:.1f},{y:.1f}" for x, y in _arrow_head(points))
+        elements.append(f'<path d="M {path}" stroke="{EDGE_COLOR}" stroke-width="3" fill="none"/>')
+        elements.append(f'<polygon points="{head}" fill="{EDGE_COLOR}"/>')
+    for box in layout["nodes"].values():
+        elements.append(f'<rect x="{box["x"]:.1f}" y="{box["y"]:.1f}" width="{box["width"]}" height="{box["height"]}" '
+                        f'rx="{NODE_RADIUS}" fill="url(#methodGrad)" filter="url(#shadow)"/>')
+        text_y = box["y"] + NODE_PADDING + (box["height"] - 2 * NODE_PADDING - len(box["lines"]) * LINE_HEIGHT) / 2
+        for i, line in enumerate(box["lines"]):
+            # Baseline of each line sits a little above the bottom of its LINE_HEIGHT slot
+            elements.append(f'<text x="{box["x"] + box["width"] / 2:.1f}" y="{text_y + (i + 0.75) * LINE_HEIGHT:.1f}" '
+                            f'text-anchor="middle" fill="{TEXT_COLOR}" font-size="{FONT_SIZE}px">{escape(line)}</text>')
+
+    body = "\n            ".join(elements)
+    return f'''<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {layout["width"]:.0f} {layout["height"]:.0f}" width="{layout["width"]:.0f}" height="{layout["height"]:.0f}" font-family="Arial, sans-serif">
+            {SVG_DEFS}
+            <rect width="100%" height="100%" fill="{BACKGROUND}"/>
+            {body}
+        </svg>
+'''
+
+
+def _load_font(size):
+    from PIL import ImageFont
+
+    for name in FONT_FILES:
+        try:
+            return ImageFont.truetype(name, size)
+        except OSError:
+            continue
+    return ImageFont.load_default(size)
+
+
+def _hex_rgb(color):
+    return tuple(int(color[i:i + 2], 16) for i in (1, 3, 5))
+
+
+def render_workflow_png(workflow_text, scale=PNG_SCALE):
+    """Renders the workflow as PNG bytes with Pillow, or returns None if it has no steps."""
+    from PIL import Image, ImageDraw, ImageFilter
+
+    nodes, edges = parse_workflow(workflow_text)
+    if not nodes:
+        return None
+    layout = layout_workflow(nodes, edges)
+    size = (int(layout["width"] * scale), int(layout["height"] * scale))
+    canvas = Image.new("RGB", size, BACKGROUND)
+
+    def px(value):
+        # Pillow wants whole pixels for widths, radii and font sizes; scale may be fractional
+        return max(1, round(value * scale))
+
+    def box_of(node):
+        return [int(node["x"] * scale), int(node["y"] * scale),
+                int((node["x"] + node["width"]) * scale), int((node["y"] + node["height"]) * scale)]
+
+    # Drop shadow: the boxes in translucent black, blurred and offset like the SVG filter
+    shadow = Image.new("L", size, 0)
+    shadow_draw = ImageDraw.Draw(shadow)
+    for node in layout["nodes"].values():
+        x0, y0, x1, y1 = box_of(node)
+        offset = px(3)
+        shadow_draw.rounded_rectangle([x0 + offset, y0 + offset, x1 + offset, y1 + offset],
+                                      radius=px(NODE_RADIUS), fill=int(255 * 0.3))
+    shadow = shadow.filter(ImageFilter.GaussianBlur(px(4)))
+    canvas.paste(Image.new("RGB", size, "black"), mask=shadow)
+
+    draw = ImageDraw.Draw(canvas)
+    edge_color = _hex_rgb(EDGE_COLOR)
+    for points in layout["edges"]:
+        line = [(x * scale, y * scale) for x, y in points[:-1] + [_shorten(points)]]
+        draw.line(line, fill=edge_color, width=px(3), joint="curve")
+        draw.polygon([(x * scale, y * scale) for x, y in _arrow_head(points)], fill=edge_color)
+
+    # Horizontal gradient fill, clipped to each rounded box
+    start, end = _hex_rgb(NODE_GRADIENT[0]), _hex_rgb(NODE_GRADIENT[1])
+    font = _load_font(px(FONT_SIZE))
+    text_color = _hex_rgb(TEXT_COLOR)
+    for node in layout["nodes"].values():
+        x0, y0, x1, y1 = box_of(node)
+        width, height = x1 - x0, y1 - y0
+        ramp = Image.linear_gradient("L").rotate(90).resize((width, height))
+        gradient = Image.merge("RGB", [ramp.point(lambda v, a=a, b=b: a + (b - a) * v // 255)
+                                       for a, b in zip(start, end)])
+        mask = Image.new("L", (width, height), 0)
+        ImageDraw.Draw(mask).rounded_rectangle([0, 0, width - 1, height - 1], radius=px(NODE_RADIUS), fill=255)
+        canvas.paste(gradient, (x0, y0), mask)
+
+        text_y = node["y"] + NODE_PADDING + (node["height"] - 2 * NODE_PADDING - len(node["lines"]) * LINE_HEIGHT) / 2
+        for i, line in enumerate(node["lines"]):
+            draw.text(((node["x"] + node["width"] / 2) * scale, (text_y + (i + 0.5) * LINE_HEIGHT) * scale),
+                      line, fill=text_color, font=font, anchor="mm")
+
+    buffer = io.BytesIO()
+    canvas.save(buffer, format="PNG", optimize=True)
+    return buffer.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("workflows", nargs="+", help="workflow.txt files written by extract_workflow or batch.py")
+    parser.add_argument("--format", nargs="+", choices=["svg", "png"], default=["svg", "png"])
+    parser.add_argument("--scale", type=float, default=PNG_SCALE, help="PNG pixels per SVG unit")
+    args = parser.parse_args()
+
+    for path in args.workflows:
+        with open(path, "r", encoding="utf-8") as f:
+            workflow_text = f.read()
+        base = os.path.join(os.path.dirname(path), "workflow_diagram")
+        if "svg" in args.format:
+            svg_code = render_workflow_svg(workflow_text)
+            if svg_code is None:
+                print(f"No workflow steps found in {path}")
+                continue
+            with open(base + ".svg", "w", encoding="utf-8") as f:
+                f.write(svg_code)
+        if "png" in args.format:
+            png_bytes = render_workflow_png(workflow_text, args.scale)
+            if png_bytes is None:
+                print(f"No workflow steps found in {path}")
+                continue
+            with open(base + ".png", "wb") as f:
+                f.write(png_bytes)
+        print(f"Rendered {path} -> {base}.{{{','.join(args.format)}}}")
+
+
+if __name__ == "__main__":
+    main()
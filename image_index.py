@@ -0,0 +1,360 @@
+"""CLIP figure embeddings and the incremental FAISS index used to place figures on slides."""
+import hashlib
+import json
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import faiss
+import numpy as np
+from PIL import Image
+
+from pdf_ingest import MIN_FIGURE_PIXELS
+from tracing import span
+
+IMAGE_EXTENSIONS = ("png", "jpg", "jpeg")
+EMBED_BATCH_SIZE = 32
+DECODE_WORKERS = 8  # Threads decoding and resizing images while CLIP encodes the previous batch
+MIN_IMAGE_SIMILARITY = 0.2  # Slides whose best available figure scores below this get a placeholder
+
+# Figure filtering ahead of embedding
+MIN_FIGURE_ENTROPY = 2.0  # Bits of grey-level entropy; blank panels, rules and flat logos fall below this
+DUPLICATE_HASH_DISTANCE = 6  # Difference hashes this many bits apart (of 64) or fewer are the same figure
+HASH_THUMBNAIL_SIZE = 256  # Entropy is measured on a thumbnail; it barely changes and is much cheaper
+
+
+def _hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+@contextmanager
+def _atomic_path(path):
+    """Yields a temporary path next to path, then moves it into place once the block succeeds."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+    os.close(fd)
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _load_image(path):
+    return Image.open(path).convert("RGB")
+
+
+def describe_image(path):
+    """Returns an image's size, grey-level entropy and 64-bit difference hash, or None if it cannot be read."""
+    try:
+        with Image.open(path) as image:
+            width, height = image.size
+            image.draft("L", (HASH_THUMBNAIL_SIZE, HASH_THUMBNAIL_SIZE))  # JPEGs decode straight to a small size
+            grey = image.convert("L")
+    except (OSError, ValueError) as e:
+        print(f"Skipping unreadable image {path}: {e}")
+        return None
+    grey.thumbnail((HASH_THUMBNAIL_SIZE, HASH_THUMBNAIL_SIZE))
+    # dHash: whether each pixel is brighter than its right neighbour on a 9x8 thumbnail
+    pixels = np.asarray(grey.resize((9, 8), Image.LANCZOS), dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return {
+        "width": width,
+        "height": height,
+        "entropy": grey.entropy(),
+        "phash": int(np.packbits(bits).view(">u8")[0]),
+    }
+
+
+def select_figures(image_paths, descriptions=None, workers=DECODE_WORKERS):
+    """Drops tiny, low-entropy and near-duplicate images, keeping the largest copy of each figure.
+
+    descriptions are describe_image() results for image_paths (computed here if not given).
+    Returns (kept paths in their original order, counts of what was dropped and why).
+    """
+    if descriptions is None:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            descriptions = list(executor.map(describe_image, image_paths))
+    stats = {"unreadable": 0, "small": 0, "low_entropy": 0, "duplicates": 0}
+    candidates = []
+    for path, description in zip(image_paths, descriptions):
+        if description is None:
+            stats["unreadable"] += 1
+        elif min(description["width"], description["height"]) < MIN_FIGURE_PIXELS:
+            stats["small"] += 1
+        elif description["entropy"] < MIN_FIGURE_ENTROPY:
+            stats["low_entropy"] += 1
+        else:
+            candidates.append((path, description))
+
+    # Largest first, so the copy kept of a repeated figure is its highest-resolution one
+    candidates.sort(key=lambda item: item[1]["width"] * item[1]["height"], reverse=True)
+    kept = set()
+    kept_hashes = np.zeros(0, dtype=np.uint64)
+    for path, description in candidates:
+        if kept_hashes.size:
+            distances = np.unpackbits((kept_hashes ^ np.uint64(description["phash"])).view(np.uint8)).reshape(-1, 64).sum(axis=1)
+            if distances.min() <= DUPLICATE_HASH_DISTANCE:
+                stats["duplicates"] += 1
+                continue
+        kept.add(path)
+        kept_hashes = np.append(kept_hashes, np.uint64(description["phash"]))
+    return [path for path in image_paths if path in kept], stats
+
+
+def list_images(image_folder):
+    """Returns the image files in a folder, sorted for consistency."""
+    return [
+        os.path.join(image_folder, filename)
+        for filename in sorted(os.listdir(image_folder))
+        if filename.lower().endswith(IMAGE_EXTENSIONS)
+    ]
+
+
+def embed_images(model, image_paths, batch_size=EMBED_BATCH_SIZE, workers=DECODE_WORKERS):
+    """Encodes images with CLIP in batches, decoding the next batch in background threads.
+
+    Embeddings are L2-normalised, so inner product search ranks by cosine similarity.
+    """
+    if not image_paths:
+        return np.zeros((0, 0), dtype="float32")
+    batches = [image_paths[start:start + batch_size] for start in range(0, len(image_paths), batch_size)]
+    embeddings = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = [executor.submit(_load_image, path) for path in batches[0]]
+        for batch_number in range(len(batches)):
+            images = [future.result() for future in pending]
+            if batch_number + 1 < len(batches):
+                pending = [executor.submit(_load_image, path) for path in batches[batch_number + 1]]
+            embeddings.append(model.encode(images, batch_size=batch_size, convert_to_numpy=True,
+                                           normalize_embeddings=True))
+    return np.vstack(embeddings).astype("float32")
+
+
+class ImageIndex:
+    """FAISS index over a figure folder that only embeds images that are new or have changed.
+
+    FAISS ids are line numbers in the path list file, so image_paths.txt keeps working as the
+    id -> path mapping. A manifest next to the index stores each file's content hash, and the
+    select_figures() description of each content hash so unchanged files are not decoded again.
+    """
+
+    def __init__(self, index_path="image_faiss.index", paths_file="image_paths.txt", manifest_path=None):
+        self.index_path = index_path
+        self.paths_file = paths_file
+        self.manifest_path = manifest_path or index_path + ".json"
+        self.index = None
+        self.paths = []  # FAISS id -> image path
+        self.hashes = []  # FAISS id -> content hash, or None once the file is gone
+        self.descriptions = {}  # content hash -> describe_image() result
+        self.load()
+
+    def load(self):
+        if os.path.exists(self.index_path) and os.path.exists(self.manifest_path):
+            self.index = faiss.read_index(self.index_path)
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            self.paths = manifest["paths"]
+            self.hashes = manifest["hashes"]
+            self.descriptions = manifest.get("descriptions", {})
+
+    def update(self, image_folder, model, batch_size=EMBED_BATCH_SIZE, workers=DECODE_WORKERS, dedup=True):
+        """Brings the index in line with the folder and returns counts of added, updated, removed and unchanged files.
+
+        With dedup, tiny, decorative and near-duplicate images are left out (see select_figures)
+        and the counts also say how many were dropped and why.
+        """
+        image_paths = list_images(image_folder)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            current_hashes = dict(zip(image_paths, executor.map(_hash_file, image_paths)))
+            # Only content not seen before is decoded; identical files share one description
+            undescribed = {content_hash: path for path, content_hash in current_hashes.items()
+                           if dedup and content_hash not in self.descriptions}
+            new_descriptions = dict(zip(undescribed, executor.map(describe_image, undescribed.values())))
+        filter_stats = {}
+        if dedup:
+            self.descriptions.update(new_descriptions)
+            descriptions = [self.descriptions[current_hashes[path]] for path in image_paths]
+            kept, filter_stats = select_figures(image_paths, descriptions)
+            current_hashes = {path: current_hashes[path] for path in kept}
+
+        ids_by_path = {path: i for i, path in enumerate(self.paths)}
+        to_embed = []  # (id, path)
+        stats = {"added": 0, "updated": 0, "removed": 0, "unchanged": 0, **filter_stats}
+        for path, content_hash in current_hashes.items():
+            image_id = ids_by_path.get(path)
+            if image_id is None:
+                image_id = len(self.paths)
+                self.paths.append(path)
+                self.hashes.append(None)
+                stats["added"] += 1
+            elif self.hashes[image_id] == content_hash:
+                stats["unchanged"] += 1
+                continue
+            elif self.hashes[image_id] is not None:
+                stats["updated"] += 1
+            else:
+                stats["added"] += 1
+            to_embed.append((image_id, path))
+            self.hashes[image_id] = content_hash
+
+        stale_ids = [image_id for image_id, content_hash in enumerate(self.hashes)
+                     if content_hash is not None and self.paths[image_id] not in current_hashes]
+        stats["removed"] = len(stale_ids)
+        for image_id in stale_ids:
+            self.hashes[image_id] = None
+
+        # Changed files keep their id, so their old vectors are removed before re-adding
+        replaced_ids = stale_ids + [image_id for image_id, _ in to_embed]
+        if self.index is not None and replaced_ids:
+            self.index.remove_ids(np.array(replaced_ids, dtype="int64"))
+
+        if to_embed:
+            with span("embed.images", items=len(to_embed),
+                      bytes_in=sum(os.path.getsize(path) for _, path in to_embed)):
+                embeddings = embed_images(model, [path for _, path in to_embed], batch_size, workers)
+            if self.index is None:
+                self.index = faiss.IndexIDMap2(faiss.IndexFlatIP(embeddings.shape[1]))
+            self.index.add_with_ids(embeddings, np.array([image_id for image_id, _ in to_embed], dtype="int64"))
+
+        if self.index is not None and (to_embed or stale_ids or new_descriptions):
+            self.save()
+        return stats
+
+    def vectors(self):
+        """Returns the indexed image paths and their stored embeddings, so callers need not encode them again."""
+        ids = [image_id for image_id, content_hash in enumerate(self.hashes) if content_hash is not None]
+        if self.index is None or not ids:
+            return [], np.zeros((0, 0), dtype="float32")
+        return [self.paths[image_id] for image_id in ids], np.vstack([self.index.reconstruct(image_id) for image_id in ids])
+
+    def save(self):
+        # Every file is written to a temporary name and swapped in, so readers never see a partial file
+        with _atomic_path(self.index_path) as tmp_path:
+            faiss.write_index(self.index, tmp_path)
+
+        # Save mapping of image paths
+        with _atomic_path(self.paths_file) as tmp_path, open(tmp_path, "w") as f:
+            for path in self.paths:
+                f.write(f"{path}\n")
+
+        with _atomic_path(self.manifest_path) as tmp_path, open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"paths": self.paths, "hashes": self.hashes, "descriptions": self.descriptions}, f)
+        print("FAISS index and image paths saved.")
+
+
+class ImageRetriever:
+    """Answers slide queries against the figure index, loading the index and path list only once.
+
+    Images placed on a slide are excluded in memory; the path list on disk is never modified.
+    """
+
+    def __init__(self, model, index_path="image_faiss.index", paths_file="image_paths.txt"):
+        self.model = model
+        self.index = faiss.read_index(index_path)
+        with open(paths_file, "r") as f:
+            self.paths = [line.strip() for line in f.readlines()]
+        self.used_ids = set()
+        self._image_ids = None
+        self._image_embeddings = None
+
+    def _load_embeddings(self):
+        """Reads every stored image vector out of the index once, for matrix scoring."""
+        if self._image_embeddings is None:
+            self._image_ids = faiss.vector_to_array(self.index.id_map).astype("int64")
+            self._image_embeddings = self.index.index.reconstruct_n(0, self.index.ntotal)
+        return self._image_ids, self._image_embeddings
+
+    def encode_queries(self, queries):
+        return self.model.encode(list(queries), convert_to_numpy=True, normalize_embeddings=True).astype("float32")
+
+    def _search(self, query_embeddings, top_k):
+        # Over-fetch by the number of used images so filtering them out still leaves top_k results
+        fetch = min(self.index.ntotal, top_k + len(self.used_ids))
+        if fetch == 0:
+            return [[] for _ in range(len(query_embeddings))]
+        with span("faiss.search", index="images", queries=len(query_embeddings)):
+            scores, ids = self.index.search(query_embeddings, fetch)
+        results = []
+        for row_scores, row_ids in zip(scores, ids):
+            row = [(int(image_id), float(score)) for image_id, score in zip(row_ids, row_scores)
+                   if image_id != -1 and image_id not in self.used_ids]
+            results.append(row[:top_k])
+        return results
+
+    def search(self, query, top_k=1):
+        """Returns [(image_path, score)] for the best images not used yet."""
+        return [(self.paths[image_id], score) for image_id, score in self._search(self.encode_queries([query]), top_k)[0]]
+
+    def mark_used(self, image_path):
+        self.used_ids.update(i for i, path in enumerate(self.paths) if path == image_path)
+
+    def assign(self, queries):
+        """Gives each query its best unused image with one batched encode and search.
+
+        Queries are served in order, so an image taken by an earlier query is skipped by later ones.
+        Returns one (image_path, score) or None per query and marks the chosen images as used.
+        """
+        if not queries:
+            return []
+        candidates = self._search(self.encode_queries(queries), len(queries))
+        assignments = []
+        for row in candidates:
+            choice = next(((image_id, score) for image_id, score in row if image_id not in self.used_ids), None)
+            if choice is None:
+                assignments.append(None)
+                continue
+            self.used_ids.add(choice[0])
+            assignments.append((self.paths[choice[0]], choice[1]))
+        return assignments
+
+    def assign_optimal(self, queries, min_similarity=MIN_IMAGE_SIMILARITY):
+        """Assigns distinct images to all queries at once, maximising their total similarity.
+
+        Unlike assign(), an early query cannot take a figure that a later query matches better.
+        Builds the full query-by-image similarity matrix and solves it with the Hungarian
+        algorithm (scipy), or a global greedy pass over all pairs if scipy is unavailable.
+        Returns one (image_path, score) or None per query and marks the chosen images as used.
+        """
+        if not queries:
+            return []
+        image_ids, image_embeddings = self._load_embeddings()
+        available = np.array([image_id not in self.used_ids for image_id in image_ids], dtype=bool)
+        image_ids = image_ids[available]
+        assignments = [None] * len(queries)
+        if len(image_ids) == 0:
+            return assignments
+
+        with span("faiss.search", index="images", queries=len(queries), candidates=len(image_ids)):
+            similarity = self.encode_queries(queries) @ image_embeddings[available].T
+        try:
+            from scipy.optimize import linear_sum_assignment
+            # Pairs under the threshold can never be used, so they must not steer the solution
+            rows, cols = linear_sum_assignment(np.where(similarity >= min_similarity, similarity, -1.0), maximize=True)
+            pairs = zip(rows, cols)
+        except ImportError:
+            pairs = []
+            taken_rows, taken_cols = set(), set()
+            for flat in np.argsort(similarity, axis=None)[::-1]:
+                row, col = np.unravel_index(flat, similarity.shape)
+                if row not in taken_rows and col not in taken_cols:
+                    taken_rows.add(row)
+                    taken_cols.add(col)
+                    pairs.append((row, col))
+
+        for row, col in pairs:
+            score = float(similarity[row, col])
+            if score < min_similarity:
+                continue
+            image_id = int(image_ids[col])
+            self.used_ids.add(image_id)
+            assignments[row] = (self.paths[image_id], score)
+        return assignments
+
+    def reset(self):
+        self.used_ids.clear()
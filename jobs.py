@@ -0,0 +1,361 @@
+"""Background jobs: a paper is submitted once, run by a worker pool, and its progress and results kept for clients.
+
+Each job runs batch.py's stages in its own folder under JOBS_DIR. Results outlive the browser
+session that asked for them, and a restarted service resumes unfinished jobs from their
+stage checkpoints. The Streamlit pages use a JobManager in-process, or the HTTP service in
+api.py when JOB_API_URL is set (see get_job_client).
+"""
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+from batch import CHROME_TRACE_FILE, TRACE_FILE, PaperJob, _write_atomic, configure_apis, resolve_stages, run_stages
+from pdf_ingest import file_hash
+
+JOBS_DIR = os.getenv("JOBS_DIR", "jobs")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))  # Jobs run at the same time; their API calls share the rate limiters
+JOB_RETENTION_SECONDS = 7 * 24 * 60 * 60  # Finished jobs older than this are deleted when the service starts
+HEARTBEAT_SECONDS = 15  # events() yields None this often while waiting, so streams can send keep-alives
+JOB_FILE = "job.json"
+INPUT_FILE = "paper.pdf"
+DEFAULT_OPTIONS = {"remark": "", "template": "LIGHT", "tts_workers": 4, "related_figures": False}
+FINISHED = ("done", "failed")
+
+
+class Job:
+    """A submitted paper: its stages, options, status and the events it has produced so far."""
+
+    def __init__(self, job_id, directory, stages, options, filename, file_hash, created_at=None, status="queued",
+                 started_at=None, finished_at=None, error=None, outputs=None):
+        self.id = job_id
+        self.directory = directory
+        self.file_hash = file_hash
+        self.stages = stages
+        self.options = options
+        self.filename = filename
+        self.created_at = created_at or time.time()
+        self.status = status
+        self.started_at = started_at
+        self.finished_at = finished_at
+        self.error = error
+        self.outputs = outputs or []
+        self.events = []  # Only this process's events; a reloaded job starts with none
+        self._condition = threading.Condition()
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "status": self.status,
+            "stages": self.stages,
+            "options": self.options,
+            "filename": self.filename,
+            "file_hash": self.file_hash,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+            "outputs": self.outputs,
+        }
+
+    def save(self):
+        _write_atomic(os.path.join(self.directory, JOB_FILE), json.dumps(self.to_dict(), indent=2))
+
+    def emit(self, event):
+        with self._condition:
+            self.events.append({"job": self.id, "time": time.time(), **event})
+            self._condition.notify_all()
+
+    def set_status(self, status, error=None):
+        self.status = status
+        self.error = error
+        self.save()
+        self.emit({"type": "status", "status": status, "error": error, "outputs": self.outputs})
+
+
+class JobManager:
+    """Queues jobs on a thread pool and lets clients follow and download them by job ID."""
+
+    def __init__(self, directory=JOBS_DIR, workers=JOB_WORKERS):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        """Picks up the jobs of earlier runs: expired ones are deleted and unfinished ones queued again."""
+        cutoff = time.time() - JOB_RETENTION_SECONDS
+        for entry in os.scandir(self.directory):
+            try:
+                with open(os.path.join(entry.path, JOB_FILE), "r", encoding="utf-8") as f:
+                    job = Job(directory=entry.path, **{("job_id" if key == "id" else key): value
+                                                       for key, value in json.load(f).items()})
+            except (OSError, ValueError, TypeError):
+                continue
+            if job.status in FINISHED and (job.finished_at or job.created_at) < cutoff:
+                shutil.rmtree(entry.path, ignore_errors=True)
+                continue
+            self._jobs[job.id] = job
+            if job.status not in FINISHED:
+                job.status = "queued"
+                self._executor.submit(self._run, job)
+
+    def submit(self, pdf_bytes, stages, filename=INPUT_FILE, **options):
+        """Stores the PDF, queues its stages (names or groups, as in batch.py) and returns the job ID."""
+        stages = resolve_stages(stages)
+        unknown = set(options) - set(DEFAULT_OPTIONS)
+        if unknown:
+            raise ValueError(f"Unknown options: {', '.join(sorted(unknown))}")
+        if not pdf_bytes.startswith(b"%PDF"):
+            raise ValueError("The upload is not a PDF")
+        job_id = uuid.uuid4().hex
+        directory = os.path.join(self.directory, job_id)
+        os.makedirs(directory)
+        _write_atomic(os.path.join(directory, INPUT_FILE), pdf_bytes)
+        job = Job(job_id, directory, stages, {**DEFAULT_OPTIONS, **options}, os.path.basename(filename),
+                  file_hash(pdf_bytes))
+        job.save()
+        with self._lock:
+            self._jobs[job_id] = job
+        job.emit({"type": "status", "status": "queued"})
+        self._executor.submit(self._run, job)
+        return job_id
+
+    def _get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            raise KeyError(job_id)
+        return job
+
+    def status(self, job_id):
+        return self._get(job_id).to_dict()
+
+    def list_jobs(self):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return [job.to_dict() for job in sorted(jobs, key=lambda job: job.created_at, reverse=True)]
+
+    def events(self, job_id, after=0, heartbeat=HEARTBEAT_SECONDS):
+        """Yields (index, event) from the after-th event on, waiting for new ones until the job finishes.
+
+        Yields None every heartbeat seconds without an event. A job finished before this process
+        started has no stored events, so it gets one final status event instead.
+        """
+        job = self._get(job_id)
+        if not job.events and job.status in FINISHED:
+            yield 0, {"job": job.id, "type": "status", "status": job.status, "error": job.error,
+                      "outputs": job.outputs}
+            return
+        index = after
+        while True:
+            with job._condition:
+                if index >= len(job.events):
+                    job._condition.wait(heartbeat)
+                pending = job.events[index:]
+            if not pending:
+                yield None
+                continue
+            for event in pending:
+                yield index, event
+                index += 1
+                if event["type"] == "status" and event["status"] in FINISHED:
+                    return
+
+    def wait(self, job_id, timeout=None):
+        """Blocks until the job finishes (or timeout seconds pass) and returns its status."""
+        job = self._get(job_id)
+        deadline = None if timeout is None else time.time() + timeout
+        with job._condition:
+            while job.status not in FINISHED:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    break
+                job._condition.wait(remaining)
+        return job.to_dict()
+
+    def output_path(self, job_id, filename):
+        """Returns the path of one of the job's results; anything else in its folder is not served."""
+        job = self._get(job_id)
+        if filename not in job.outputs:
+            raise KeyError(filename)
+        return os.path.join(job.directory, filename)
+
+    def read_output(self, job_id, filename):
+        with open(self.output_path(job_id, filename), "rb") as f:
+            return f.read()
+
+    def _run(self, job):
+        job.started_at = time.time()
+        job.set_status("running")
+        try:
+            configure_apis(job.stages)
+            paper = PaperJob(os.path.join(job.directory, INPUT_FILE), None, SimpleNamespace(**{**DEFAULT_OPTIONS, **job.options}),
+                             directory=job.directory, on_event=job.emit)
+            records = run_stages(paper, job.stages)
+            # Stages skipped on a resumed job were done by the run before, so their outputs count too
+            job.outputs = [output for stage in job.stages
+                           for output in paper.state["stages"].get(stage, {}).get("outputs", [])
+                           if paper.is_done(stage)]
+            job.outputs += [name for name in (TRACE_FILE, CHROME_TRACE_FILE)
+                            if os.path.exists(paper.path(name))]
+            failed = [stage for stage, record in records.items() if record["status"] in ("failed", "blocked")]
+            error = (f"{failed[0]}: {records[failed[0]].get('error', 'blocked by an earlier stage')}"
+                     if failed else None)
+        except Exception as e:
+            print(f"❌ Job {job.id} failed: {e}")
+            failed, error = True, str(e)
+        job.finished_at = time.time()
+        job.set_status("failed" if failed else "done", error)
+
+
+class JobClient:
+    """HTTP client for api.py with the same methods as JobManager, so pages can use either."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip("/")
+
+    def _url(self, path):
+        return f"{self.base_url}{path}"
+
+    @staticmethod
+    def _check(response):
+        if response.status_code == 404:
+            raise KeyError(response.url)
+        if response.status_code == 400:
+            raise ValueError(response.json().get("error", response.text))
+        response.raise_for_status()
+        return response
+
+    def submit(self, pdf_bytes, stages, filename=INPUT_FILE, **options):
+        import requests
+
+        params = {"stages": ",".join(stages), "filename": filename, **options}
+        response = requests.post(self._url("/jobs"), params=params, data=pdf_bytes,
+                                 headers={"Content-Type": "application/pdf"}, timeout=60)
+        return self._check(response).json()["id"]
+
+    def status(self, job_id):
+        import requests
+
+        return self._check(requests.get(self._url(f"/jobs/{job_id}"), timeout=30)).json()
+
+    def list_jobs(self):
+        import requests
+
+        return self._check(requests.get(self._url("/jobs"), timeout=30)).json()
+
+    def events(self, job_id, after=0, heartbeat=HEARTBEAT_SECONDS):
+        """Follows the job's server-sent events; yields (index, event), or None on a keep-alive."""
+        import requests
+
+        headers = {"Accept": "text/event-stream", "Last-Event-ID": str(after - 1)}
+        with requests.get(self._url(f"/jobs/{job_id}/events"), headers=headers, stream=True,
+                          timeout=(10, heartbeat * 3)) as response:
+            self._check(response)
+            index, data = None, []
+            for line in response.iter_lines(decode_unicode=True):
+                if line.startswith("id:"):
+                    index = int(line[3:].strip())
+                elif line.startswith("data:"):
+                    data.append(line[5:].strip())
+                elif line.startswith(":"):
+                    yield None
+                elif not line and data:
+                    yield index, json.loads("\n".join(data))
+                    index, data = None, []
+
+    def wait(self, job_id, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+        for item in self.events(job_id):
+            if item is not None and item[1]["type"] == "status" and item[1]["status"] in FINISHED:
+                break
+            if deadline is not None and time.time() > deadline:
+                break
+        return self.status(job_id)
+
+    def read_output(self, job_id, filename):
+        import requests
+
+        return self._check(requests.get(self._url(f"/jobs/{job_id}/files/{filename}"), timeout=60)).content
+
+
+_default_manager = None
+_default_manager_lock = threading.Lock()
+
+
+def get_job_manager():
+    """Returns the process-wide job manager, starting its workers on first use."""
+    global _default_manager
+    with _default_manager_lock:
+        if _default_manager is None:
+            _default_manager = JobManager()
+    return _default_manager
+
+
+def get_job_client():
+    """Returns a client for the job service at JOB_API_URL, or this process's own job manager if it is not set."""
+    base_url = os.getenv("JOB_API_URL")
+    return JobClient(base_url) if base_url else get_job_manager()
+
+
+def find_or_submit(client, pdf_bytes, stages, filename=INPUT_FILE, **options):
+    """Returns the ID of a queued, running or done job for the same paper, stages and options, else submits one.
+
+    This is how a page reattaches to its job after a rerun, a reload or a dropped connection.
+    """
+    pdf_hash, stages = file_hash(pdf_bytes), resolve_stages(stages)
+    wanted = {**DEFAULT_OPTIONS, **options}
+    for job in client.list_jobs():
+        if (job["file_hash"] == pdf_hash and job["stages"] == stages and job["options"] == wanted
+                and job["status"] != "failed"):
+            return job["id"]
+    return client.submit(pdf_bytes, stages, filename, **options)
+
+
+def load_job_trace(client, job_id):
+    """Returns the job's saved trace, or None if it has none yet."""
+    from tracing import Trace
+
+    if TRACE_FILE not in client.status(job_id)["outputs"]:
+        return None
+    return Trace.from_dict(json.loads(client.read_output(job_id, TRACE_FILE)))
+
+
+def follow_job(client, job_id, labels):
+    """Shows a job's progress in Streamlit until it finishes and returns its final status.
+
+    labels maps stage names to the text shown while they run. Leaving the page or rerunning only
+    stops the watching; the job carries on and the next run picks it up again.
+    """
+    import streamlit as st
+
+    status_box = st.empty()
+    progress_bar = st.progress(0.0)
+    stages = client.status(job_id)["stages"]
+    finished = set()
+    for item in client.events(job_id):
+        if item is None:
+            continue
+        _, event = item
+        if event["type"] == "status":
+            if event["status"] == "queued":
+                status_box.info("⏳ Waiting for a free worker...")
+        elif event["type"] == "stage":
+            if event["status"] == "running":
+                status_box.info(f"{labels.get(event['stage'], event['stage'])}...")
+            else:
+                finished.add(event["stage"])
+            progress_bar.progress(len(finished) / len(stages))
+        elif event["type"] == "progress":
+            # Progress within a stage fills that stage's share of the bar
+            progress_bar.progress(min((len(finished) + event["value"]) / len(stages), 1.0))
+    status_box.empty()
+    progress_bar.empty()
+    return client.status(job_id)
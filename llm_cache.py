@@ -0,0 +1,156 @@
+"""Persistent response cache shared by the Groq and Gemini calls in the podcast, visualizer and PPT pipelines."""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from rate_limit import get_limiter
+from tracing import current_trace, span
+
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", ".llm_cache.sqlite3")
+DEFAULT_TTL = 7 * 24 * 60 * 60  # Responses older than a week are treated as misses
+MAX_ENTRIES = 5000  # Least recently used responses are evicted above this count
+# Configs at least this hot are meant to vary between calls, so by default they bypass the cache.
+# The low-temperature extraction and summary calls stay cached.
+SAMPLING_TEMPERATURE = 0.5
+
+
+class LLMCache:
+    """SQLite-backed cache of LLM responses keyed by model, messages and generation config."""
+
+    def __init__(self, path=LLM_CACHE_PATH, ttl=DEFAULT_TTL, max_entries=MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    model TEXT,
+                    response TEXT,
+                    created_at REAL,
+                    last_used REAL
+                )"""
+            )
+
+    @staticmethod
+    def make_key(model, messages, config):
+        """Hashes everything that influences the response into a cache key."""
+        payload = json.dumps({"model": model, "messages": messages, "config": config},
+                             sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """Returns the cached response for the key, or None if it is missing or expired."""
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            response, created_at = row
+            if self.ttl is not None and now - created_at > self.ttl:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None
+            self._conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+        return response
+
+    def set(self, key, model, response):
+        """Stores a response, then evicts the least recently used entries beyond max_entries."""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, response, created_at, last_used) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, model, response, now, now),
+            )
+            self._conn.execute(
+                "DELETE FROM responses WHERE key IN ("
+                "SELECT key FROM responses ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def cached_call(self, model, messages, config, call, use_cache=True):
+        """Returns the cached response for this request, or runs call() and caches its text."""
+        if not use_cache:
+            return call()
+        key = self.make_key(model, messages, config)
+        response = self.get(key)
+        # Counters are bumped from worker threads (TTS, extraction fan-out, batch papers)
+        with self._lock:
+            if response is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if response is not None:
+            return response
+        response = call()
+        if response is not None:
+            self.set(key, model, response)
+        return response
+
+    def stats(self):
+        """Returns hit/miss counters for this process and the number of stored responses."""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "entries": entries}
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM responses")
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_llm_cache():
+    """Returns the process-wide cache, opening it on first use."""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = LLMCache()
+    return _default_cache
+
+
+def is_sampling(config):
+    """True for generation configs whose output is meant to differ from call to call."""
+    return (config or {}).get("temperature", 0) >= SAMPLING_TEMPERATURE
+
+
+def cached_completion(model, messages, config, call, use_cache=None):
+    """Runs an LLM call through the shared cache; call() must return the response text.
+
+    use_cache=None caches unless the config samples (see is_sampling). Cache misses wait for the
+    "llm" rate limit before calling the API.
+    """
+    if use_cache is None:
+        use_cache = not is_sampling(config)
+    called = []
+
+    def limited_call():
+        called.append(True)
+        get_limiter("llm").acquire()
+        return call()
+
+    with span("llm", model=model) as attrs:
+        response = get_llm_cache().cached_call(model, messages, config, limited_call, use_cache=use_cache)
+        attrs["cache_hit"] = not called
+        if current_trace() is not None:
+            from summarize import count_tokens
+            attrs["tokens_in"] = count_tokens(_prompt_text(messages))
+            attrs["tokens_out"] = count_tokens(response or "")
+    return response
+
+
+def _prompt_text(messages):
+    """Joins Gemini-style string parts and OpenAI-style message dicts into one string."""
+    return "\n".join(message if isinstance(message, str) else str(message.get("content", "")) for message in messages)
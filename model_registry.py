@@ -0,0 +1,117 @@
+"""Process-wide registry that loads models and API clients on first use and shares them afterwards."""
+import os
+import threading
+import time
+
+# "default", "quantized" (int8 dynamic, CPU) or "onnx". "quantized" loads the fp32 weights and converts
+# them, so it starts slower than "default" but uses less memory and encodes faster. "onnx" loads a
+# prebuilt artifact instead of converting anything at start-up.
+MODEL_VARIANT = os.getenv("MODEL_VARIANT", "default")
+WARM_UP_MODELS = os.getenv("WARM_UP_MODELS", "")  # Comma-separated names to load when warm_up() is called
+
+
+def _rss_bytes():
+    """Returns the resident memory of this process, or 0 if it cannot be read."""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return 0
+
+
+def _load_sentence_transformer(name):
+    from sentence_transformers import SentenceTransformer
+
+    if MODEL_VARIANT == "onnx":
+        try:
+            return SentenceTransformer(name, backend="onnx", device="cpu")
+        except Exception as e:
+            print(f"ONNX variant of {name} unavailable ({e}), loading the default model")
+    model = SentenceTransformer(name)
+    if MODEL_VARIANT == "quantized":
+        # Quantised after the full fp32 load: a memory and inference saving, not a load-time one
+        import torch
+        model = torch.quantization.quantize_dynamic(model.to("cpu"), {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    return model
+
+
+def _load_clip_tokenizer():
+    from transformers import CLIPTokenizer
+    return CLIPTokenizer.from_pretrained("openai/clip-vit-base-patch32")
+
+
+def _load_groq_client():
+    import groq
+    return groq.Client(api_key=os.getenv("GROQ_API_KEY", "your_api_key"))
+
+
+_loaders = {
+    "clip": lambda: _load_sentence_transformer("clip-ViT-B-32"),
+    "minilm": lambda: _load_sentence_transformer("all-MiniLM-L6-v2"),
+    "clip-tokenizer": _load_clip_tokenizer,
+    "groq": _load_groq_client,
+}
+_models = {}
+_stats = {}
+_locks = {}
+_registry_lock = threading.Lock()
+_warmed_up = False
+
+
+def register_model(name, loader):
+    """Registers (or replaces) the zero-argument loader used for a model name."""
+    with _registry_lock:
+        _loaders[name] = loader
+        _models.pop(name, None)
+
+
+def get_model(name):
+    """Returns the shared instance of a model, loading it on first use."""
+    model = _models.get(name)
+    if model is not None:
+        return model
+    with _registry_lock:
+        if name not in _loaders:
+            raise KeyError(f"Unknown model: {name}")
+        lock = _locks.setdefault(name, threading.Lock())
+    # Loading holds only this model's lock, so different models can load in parallel
+    with lock:
+        model = _models.get(name)
+        if model is None:
+            rss_before = _rss_bytes()
+            start = time.perf_counter()
+            model = _loaders[name]()
+            load_seconds = time.perf_counter() - start
+            memory_bytes = max(_rss_bytes() - rss_before, 0)
+            _stats[name] = {"load_seconds": load_seconds, "memory_bytes": memory_bytes, "variant": MODEL_VARIANT}
+            _models[name] = model
+            print(f"Loaded {name} in {load_seconds:.2f}s (+{memory_bytes / 2**20:.0f} MB resident)")
+    return model
+
+
+def warm_up(names=None, background=True):
+    """Loads models ahead of the first request; defaults to the WARM_UP_MODELS list and runs once per process."""
+    global _warmed_up
+    if names is None:
+        with _registry_lock:
+            if _warmed_up:
+                return []
+            _warmed_up = True
+        names = [name.strip() for name in WARM_UP_MODELS.split(",") if name.strip()]
+    threads = [threading.Thread(target=get_model, args=(name,), daemon=True) for name in names]
+    for thread in threads:
+        thread.start()
+    if not background:
+        for thread in threads:
+            thread.join()
+    return threads
+
+
+def model_stats():
+    """Returns load time (s), resident memory added (bytes) and variant for each loaded model."""
+    return {name: dict(stats) for name, stats in _stats.items()}
@@ -0,0 +1,678 @@
+"""Single-pass PDF ingestion shared by the podcast, graphical abstract and PPT pipelines."""
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import tempfile
+import threading
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+
+from tracing import span
+
+INGEST_CACHE_DIR = os.getenv("INGEST_CACHE_DIR", ".ingest_cache")
+DEFAULT_BACKENDS = ("pymupdf", "pypdf2")  # Fastest first; later ones are only tried if earlier ones fail
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", "0")) or os.cpu_count() or 1
+PARALLEL_MIN_PAGES = 64  # Shorter documents are read serially; starting workers costs more than it saves
+TASKS_PER_WORKER = 4  # Page ranges per worker, so uneven pages still balance out
+# Workers are spawned, not forked: Streamlit and the job service are multi-threaded, and a forked child
+# can inherit a lock held by another thread and deadlock on it
+POOL_CONTEXT = multiprocessing.get_context("spawn")
+
+# Figure extraction: "fast" reads embedded images and vector drawings with PyMuPDF,
+# "hi_res" runs unstructured's layout detection and OCR (slow; for scanned papers)
+FIGURE_STRATEGY = os.getenv("FIGURE_STRATEGY", "fast")
+FIGURE_PARALLEL_MIN_PAGES = 8  # Rendering crops is heavier than reading text, so parallelise sooner
+MIN_FIGURE_PIXELS = 64  # Images narrower or shorter than this are icons and logos (also used by select_figures)
+MIN_DRAWING_POINTS = 72  # Vector drawings smaller than an inch on either side are rules and decorations
+MAX_DRAWING_PAGE_FRACTION = 0.9  # Larger drawings are page borders or backgrounds
+DRAWING_DPI = 150
+DRAWING_PADDING = 4  # Points around a drawing's bounds, so edge labels are not clipped
+
+# Regex pattern for typical research paper headings
+HEADING_PATTERN = re.compile(r"(?m)^(Abstract|Introduction|Proposed Approach|Methodology|Dataset|Results|Performance Evaluation|Conclusion|References)", re.IGNORECASE)
+
+# Layout-aware section detection from PyMuPDF span fonts
+HEADING_SIZE_RATIO = 1.15  # Lines this much larger than the body font are headings even when not bold
+MAX_HEADING_CHARS = 120
+MAX_HEADING_WORDS = 14
+REPEATED_LINE_PAGES = 3  # Short lines repeated on this many pages are running headers and footers
+MIN_OUTLINE_HEADINGS = 2  # Fewer detected headings fall back to HEADING_PATTERN
+FRONT_MATTER = "Front Matter"  # Name of the text before the first heading (title, authors)
+SECTION_NUMBER_PATTERN = re.compile(r"^(\d{1,2}(?:\.\d{1,2})*\.?|[IVX]{1,5}\.|[A-H]\.)(?:\s+|$)")
+CAPTION_PATTERN = re.compile(r"^(fig(ure)?|table|tab|algorithm|listing|eq(uation)?)\.?\s*\d", re.IGNORECASE)
+RUN_IN_HEADING_PATTERN = re.compile(r"^(Abstract|Keywords|Index Terms)\b", re.IGNORECASE)
+KNOWN_HEADING_PATTERN = re.compile(
+    r"^(abstract|introduction|background|related work|method|methodology|approach|experiment|evaluation|results?"
+    r"|discussion|conclusions?|limitations|future work|acknowledg|references|bibliography|appendix)", re.IGNORECASE)
+
+# Title keywords of the sections each consumer sends to its prompts (see PaperDocument.select_text)
+SECTION_KEYWORDS = {
+    "abstract": ("abstract",),
+    "methods": ("method", "approach", "proposed", "architecture", "framework", "experimental setup",
+                "materials", "implementation", "dataset", "system design"),
+    "results": ("result", "evaluation", "experiment", "performance", "discussion", "analysis"),
+    "conclusion": ("conclusion", "future work", "summary"),
+    "back_matter": ("reference", "bibliography", "acknowledg", "appendix", "supplementary"),
+}
+
+
+@dataclass
+class PaperDocument:
+    """Everything the pipelines need from one PDF, extracted in a single pass."""
+    file_hash: str
+    backend: str
+    pages: list  # Text of each page, in order
+    sections: dict  # Heading -> section text
+    figures: list  # Paths of the extracted figure images; None if figures were not asked for
+    outline: list  # Headings in reading order: title, number, level, page, start/end in text, parent (see detect_outline)
+
+    @property
+    def text(self):
+        return "\n".join(self.pages)
+
+    @property
+    def body_text(self):
+        """The text without references, acknowledgements and appendices."""
+        return self.select_text(exclude=SECTION_KEYWORDS["back_matter"]) or self.text
+
+    def select_text(self, include=(), exclude=()):
+        """Returns the sections whose titles contain an include keyword (all, if none given) and no exclude keyword.
+
+        Subsections come with their section, and excluding a section excludes its subsections.
+        Returns "" when nothing matches, so callers can fall back to the full text.
+        """
+        text = self.text
+        if not self.outline:
+            return "" if include else text
+        # Text before the first heading belongs to no section; it is only kept when nothing is asked for
+        spans = [(0, self.outline[0]["start"])] if not include else []
+        selected = set()
+        excluded = set()
+        for i, entry in enumerate(self.outline):
+            title = entry["title"].lower()
+            parent = entry["parent"]
+            if parent in excluded or any(keyword in title for keyword in exclude):
+                excluded.add(i)
+            elif parent in selected:
+                selected.add(i)  # Already inside a selected section's span
+            elif not include or any(keyword in title for keyword in include):
+                selected.add(i)
+                spans.append((entry["start"], entry["end"]))
+        # Excluded subsections are cut out of their selected ancestors' spans
+        for i in excluded:
+            start, end = self.outline[i]["start"], self.outline[i]["end"]
+            spans = [piece for a, b in spans for piece in ((a, min(b, start)), (max(a, end), b)) if piece[0] < piece[1]]
+        return "\n\n".join(text[a:b].strip() for a, b in sorted(spans) if text[a:b].strip())
+
+
+_documents = {}  # (file hash, backends) -> PaperDocument, for this process
+_documents_lock = threading.Lock()
+
+
+def _read_source(source):
+    """Returns the PDF bytes from a path, raw bytes or a file-like object (e.g. a Streamlit upload)."""
+    if isinstance(source, (bytes, bytearray)):
+        return bytes(source)
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            return f.read()
+    if hasattr(source, "getvalue"):
+        return source.getvalue()
+    return source.read()
+
+
+def file_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def split_into_sections(text):
+    """Splits research paper text into structured sections based on headings."""
+    sections = {}
+    current_section = "Introduction"  # Default to Introduction if no heading is found
+    sections[current_section] = []
+
+    for line in text.split("\n"):
+        match = HEADING_PATTERN.match(line.strip())
+        if match:
+            current_section = match.group(0)
+            sections[current_section] = []
+        sections[current_section].append(line.strip())
+
+    # Join lists into strings for easy processing
+    return {k: "\n".join(v) for k, v in sections.items()}
+
+
+def _is_bold(text_span):
+    return bool(text_span["flags"] & 16) or any(weight in text_span["font"]
+                                                for weight in ("Bold", "Black", "Heavy", "Semibold", "CMBX"))
+
+
+def _line_key(text):
+    """Line text with digits, punctuation and case removed, so "Page 3" and "Page 4" count as one repeated line."""
+    return re.sub(r"[\W\d_]+", " ", text).strip().lower()
+
+
+def _scan_page_lines(doc):
+    """Streams over the pages once, collecting the font size histogram and every short line with its style."""
+    import fitz  # PyMuPDF
+
+    size_chars = Counter()  # Rounded font size -> characters set in it
+    lines = []
+    for page_index, page in enumerate(doc):
+        # Same flags as get_text(), so line texts match the page text; images are left out, as they are slow to decode
+        for block in page.get_text("dict", flags=fitz.TEXTFLAGS_TEXT)["blocks"]:
+            for line in block.get("lines", ()):
+                spans = [text_span for text_span in line["spans"] if text_span["text"].strip()]
+                if not spans:
+                    continue
+                for text_span in spans:
+                    size_chars[round(text_span["size"] * 2) / 2] += len(text_span["text"].strip())
+                text = " ".join("".join(text_span["text"] for text_span in line["spans"]).split())
+                if len(text) > MAX_HEADING_CHARS:
+                    continue
+                lines.append({
+                    "page": page_index,
+                    "block": block["number"],
+                    "text": text,
+                    "size": round(max(text_span["size"] for text_span in spans) * 2) / 2,
+                    "bold": all(_is_bold(text_span) for text_span in spans),
+                    "lead": spans[0]["text"].strip() if _is_bold(spans[0]) else "",
+                })
+    return size_chars, lines
+
+
+def _heading_candidates(size_chars, lines):
+    """Picks the lines whose font, weight or numbering sets them apart from body text."""
+    if not size_chars:
+        return []
+    body_size = size_chars.most_common(1)[0][0]
+    pages_by_line = defaultdict(set)
+    for line in lines:
+        pages_by_line[_line_key(line["text"])].add(line["page"])
+    # The largest font on the first page is the paper title, unless headings later on use it too
+    first_page_sizes = [line["size"] for line in lines if line["page"] == 0]
+    title_size = max(first_page_sizes, default=None)
+    if any(line["size"] == title_size for line in lines if line["page"] > 0):
+        title_size = None
+
+    candidates = []
+    bare_number = None  # The previous line, when it was a section number on its own
+    for line in lines:
+        text = line["text"]
+        # The title after a bare number is a heading whatever its font
+        follows_number = (bare_number is not None and bare_number["page"] == line["page"]
+                          and bare_number["block"] == line["block"])
+        bare_number = None
+        run_in = RUN_IN_HEADING_PATTERN.match(line["lead"])
+        if run_in:
+            # "Abstract—We propose ..." starts the abstract on the same line as its first sentence
+            candidates.append({**line, "title": run_in.group(1), "number": ""})
+            continue
+        if (line["page"] == 0 and line["size"] == title_size) or CAPTION_PATTERN.match(text):
+            continue
+        key = _line_key(text)
+        if key and len(pages_by_line[key]) >= REPEATED_LINE_PAGES:
+            continue
+        number_match = SECTION_NUMBER_PATTERN.match(text)
+        number = number_match.group(1).rstrip(".") if number_match else ""
+        title = text[number_match.end():] if number_match else text
+        larger = line["size"] >= body_size * HEADING_SIZE_RATIO
+        if not (larger or follows_number or (line["bold"] and line["size"] >= body_size - 0.5)):
+            continue
+        if number and not title:
+            candidates.append({**line, "title": "", "number": number})  # "1" set apart from its title, as LaTeX does
+            bare_number = line
+            continue
+        first_letter = next((char for char in title if char.isalpha()), "")
+        if (not first_letter or first_letter.islower() or len(title.split()) > MAX_HEADING_WORDS
+                or title.endswith((".", ",", ";", ":"))):
+            continue
+        candidates.append({**line, "title": title, "number": number})
+    return candidates
+
+
+def _merge_heading_lines(candidates):
+    """Joins a bare section number to the title after it, and headings wrapped over several lines."""
+    merged = []
+    for candidate in candidates:
+        previous = merged[-1] if merged else None
+        if previous and previous["page"] == candidate["page"] and not candidate["number"] and (
+                not previous["title"] or (previous["block"] == candidate["block"] and previous["size"] == candidate["size"]
+                                          and previous["bold"] == candidate["bold"])):
+            if not previous["title"]:
+                # Unnumbered headings share the title's font, not the number's
+                previous["size"], previous["bold"] = candidate["size"], candidate["bold"]
+            previous["title"] = f"{previous['title']} {candidate['title']}".strip()
+            continue
+        merged.append(dict(candidate))
+    return [candidate for candidate in merged if candidate["title"]]
+
+
+def _heading_level(number):
+    if not number:
+        return None
+    if re.fullmatch(r"[IVX]+", number):
+        return 1
+    if re.fullmatch(r"[A-H]", number):
+        return 2
+    return number.count(".") + 1
+
+
+def _locate_headings(headings, pages):
+    """Turns headings into outline entries with character offsets into the joined page text."""
+    page_offsets = []
+    offset = 0
+    for page_text in pages:
+        page_offsets.append(offset)
+        offset += len(page_text) + 1
+    cursors = {}
+    outline = []
+    for heading in headings:
+        page_text = pages[heading["page"]] if heading["page"] < len(pages) else ""
+        # Headings are found in page order, each as a whole line after the previous one on its page
+        pattern = r"(?m)^[ \t]*(" + r"\s+".join(map(re.escape, heading["text"].split())) + r")[ \t]*$"
+        match = re.compile(pattern).search(page_text, cursors.get(heading["page"], 0))
+        if not match:
+            continue
+        position = match.start(1)
+        cursors[heading["page"]] = match.end()
+        outline.append({
+            "title": heading["title"],
+            "number": heading["number"],
+            "level": heading["level"],
+            "page": heading["page"] + 1,
+            "start": page_offsets[heading["page"]] + position,
+        })
+    return _link_outline(outline, offset - 1 if pages else 0)
+
+
+def _link_outline(outline, text_length):
+    """Adds each entry's end offset (where the next heading at its level or above starts) and parent index."""
+    outline.sort(key=lambda entry: entry["start"])
+    stack = []  # Indices of the open sections, outermost first
+    for i, entry in enumerate(outline):
+        while stack and outline[stack[-1]]["level"] >= entry["level"]:
+            outline[stack.pop()]["end"] = entry["start"]
+        entry["parent"] = stack[-1] if stack else None
+        stack.append(i)
+    for i in stack:
+        outline[i]["end"] = text_length
+    return outline
+
+
+def detect_outline(doc, pages):
+    """Finds the section headings of a PyMuPDF document from its span fonts, in one pass over the pages.
+
+    A line is a heading when it is set larger than the body text, or in bold, and reads like a
+    title (short, capitalised, no closing full stop); captions and running headers are skipped.
+    Levels come from numbering ("3.2" is level 2, "IV." level 1, "B." level 2) or, for unnumbered
+    papers, from font size. Returns the outline entries (see _locate_headings), or [] if fewer
+    than MIN_OUTLINE_HEADINGS were found.
+    """
+    size_chars, lines = _scan_page_lines(doc)
+    headings = _merge_heading_lines(_heading_candidates(size_chars, lines))
+    numbered_styles = {(heading["size"], heading["bold"]): _heading_level(heading["number"])
+                       for heading in headings if _heading_level(heading["number"])}
+    if numbered_styles:
+        # In numbered papers an unnumbered heading must look like a numbered one or be a standard section name
+        headings = [heading for heading in headings
+                    if heading["number"] or (heading["size"], heading["bold"]) in numbered_styles
+                    or KNOWN_HEADING_PATTERN.match(heading["title"])]
+    unnumbered_sizes = sorted({heading["size"] for heading in headings if not heading["number"]}, reverse=True)
+    for heading in headings:
+        # Standard section names (Abstract, References) are top-level whatever their font
+        heading["level"] = (_heading_level(heading["number"])
+                            or (1 if KNOWN_HEADING_PATTERN.match(heading["title"]) else None)
+                            or numbered_styles.get((heading["size"], heading["bold"]))
+                            or (1 if numbered_styles else unnumbered_sizes.index(heading["size"]) + 1))
+    outline = _locate_headings(headings, pages)
+    return outline if len(outline) >= MIN_OUTLINE_HEADINGS else []
+
+
+def _regex_outline(pages):
+    """Fallback outline from HEADING_PATTERN, for backends without font information."""
+    outline = []
+    offset = 0
+    for page_number, page_text in enumerate(pages, start=1):
+        line_start = 0
+        for line in page_text.split("\n"):
+            match = HEADING_PATTERN.match(line.strip())
+            if match:
+                outline.append({"title": match.group(0), "number": "", "level": 1, "page": page_number,
+                                "start": offset + line_start + line.index(match.group(0))})
+            line_start += len(line) + 1
+        offset += len(page_text) + 1
+    return _link_outline(outline, max(offset - 1, 0))
+
+
+def outline_sections(text, outline):
+    """Heading -> section text for the top-level sections of an outline, like split_into_sections."""
+    sections = {}
+    if outline and text[:outline[0]["start"]].strip():
+        sections[FRONT_MATTER] = text[:outline[0]["start"]].strip()
+    for entry in outline:
+        if entry["parent"] is not None:
+            continue
+        name = f"{entry['number']} {entry['title']}".strip()
+        while name in sections:
+            name += "'"
+        sections[name] = text[entry["start"]:entry["end"]].strip()
+    return sections
+
+
+def _open_document(backend, data):
+    if backend == "pymupdf":
+        import fitz  # PyMuPDF
+        return fitz.open(stream=data, filetype="pdf")
+    import PyPDF2
+    return PyPDF2.PdfReader(io.BytesIO(data))
+
+
+def _page_count(backend, handle):
+    return len(handle) if backend == "pymupdf" else len(handle.pages)
+
+
+def _page_text(backend, handle, page_index):
+    if backend == "pymupdf":
+        return handle[page_index].get_text()
+    return handle.pages[page_index].extract_text() or ""
+
+
+# Each pool worker opens the document once and then reads the page ranges it is given
+_worker_backend = None
+_worker_handle = None
+
+
+def _init_page_worker(backend, data):
+    global _worker_backend, _worker_handle
+    _worker_backend = backend
+    _worker_handle = _open_document(backend, data)
+
+
+def _read_page_range(page_range):
+    start, stop = page_range
+    return [_page_text(_worker_backend, _worker_handle, i) for i in range(start, stop)]
+
+
+def extract_page_texts(data, backend="pymupdf", workers=None, handle=None):
+    """Returns the text of every page, splitting long documents into page ranges across a process pool."""
+    if handle is None:
+        handle = _open_document(backend, data)
+    page_count = _page_count(backend, handle)
+    workers = PDF_WORKERS if workers is None else workers
+
+    if workers <= 1 or page_count < PARALLEL_MIN_PAGES:
+        return [_page_text(backend, handle, i) for i in range(page_count)]
+
+    chunk_size = -(-page_count // (workers * TASKS_PER_WORKER))
+    page_ranges = [(start, min(start + chunk_size, page_count)) for start in range(0, page_count, chunk_size)]
+    with ProcessPoolExecutor(max_workers=workers, mp_context=POOL_CONTEXT, initializer=_init_page_worker,
+                             initargs=(backend, data)) as executor:
+        chunks = executor.map(_read_page_range, page_ranges)
+        return [text for chunk in chunks for text in chunk]
+
+
+def _first_image_pages(doc):
+    """Maps page index -> [(image number, xref)] for images not already seen on an earlier page."""
+    seen_xrefs = set()
+    images_by_page = {}
+    for page_index, page in enumerate(doc):
+        for image_number, image in enumerate(page.get_images(full=True), start=1):
+            xref = image[0]
+            if xref in seen_xrefs:
+                continue
+            seen_xrefs.add(xref)
+            images_by_page.setdefault(page_index, []).append((image_number, xref))
+    return images_by_page
+
+
+def _page_figures(doc, page_index, images, figures_dir, min_pixels=0, drawings=False):
+    """Writes one page's embedded images and (optionally) rendered vector drawings; returns their paths."""
+    import fitz  # PyMuPDF
+
+    page_number = page_index + 1
+    figures = []
+    for image_number, xref in images:
+        extracted = doc.extract_image(xref)
+        if not extracted or min(extracted["width"], extracted["height"]) < min_pixels:
+            continue
+        path = os.path.join(figures_dir, f"figure-{page_number}-{image_number}.{extracted['ext']}")
+        with open(path, "wb") as f:
+            f.write(extracted["image"])
+        figures.append(path)
+    if not drawings:
+        return figures
+
+    page = doc[page_index]
+    image_rects = [rect for image in page.get_images(full=True) for rect in page.get_image_rects(image[0])]
+    page_area = page.rect.width * page.rect.height
+    drawing_number = 0
+    for rect in page.cluster_drawings():
+        if min(rect.width, rect.height) < MIN_DRAWING_POINTS or rect.width * rect.height > page_area * MAX_DRAWING_PAGE_FRACTION:
+            continue
+        # Frames drawn around a raster image would duplicate the image itself
+        if any((rect & image_rect).get_area() > 0.5 * rect.get_area() for image_rect in image_rects):
+            continue
+        drawing_number += 1
+        clip = (rect + (-DRAWING_PADDING, -DRAWING_PADDING, DRAWING_PADDING, DRAWING_PADDING)) & page.rect
+        path = os.path.join(figures_dir, f"drawing-{page_number}-{drawing_number}.png")
+        page.get_pixmap(clip=clip, dpi=DRAWING_DPI, colorspace=fitz.csRGB, alpha=False).save(path)
+        figures.append(path)
+    return figures
+
+
+def _extract_figure_range(task):
+    """Pool task: extracts figures from a range of pages of the worker's document."""
+    start, stop, images_by_page, figures_dir, min_pixels = task
+    return [path for page_index in range(start, stop)
+            for path in _page_figures(_worker_handle, page_index, images_by_page.get(page_index, []),
+                                      figures_dir, min_pixels, drawings=True)]
+
+
+def _extract_figures_fast(data, figures_dir, workers=None, min_pixels=MIN_FIGURE_PIXELS):
+    with _open_document("pymupdf", data) as doc:
+        page_count = len(doc)
+        images_by_page = _first_image_pages(doc)
+        workers = PDF_WORKERS if workers is None else workers
+        if workers <= 1 or page_count < FIGURE_PARALLEL_MIN_PAGES:
+            return [path for page_index in range(page_count)
+                    for path in _page_figures(doc, page_index, images_by_page.get(page_index, []),
+                                              figures_dir, min_pixels, drawings=True)]
+
+    chunk_size = -(-page_count // (workers * TASKS_PER_WORKER))
+    tasks = [(start, min(start + chunk_size, page_count), images_by_page, figures_dir, min_pixels)
+             for start in range(0, page_count, chunk_size)]
+    with ProcessPoolExecutor(max_workers=workers, mp_context=POOL_CONTEXT, initializer=_init_page_worker,
+                             initargs=("pymupdf", data)) as executor:
+        return [path for chunk in executor.map(_extract_figure_range, tasks) for path in chunk]
+
+
+def _extract_figures_hi_res(data, figures_dir):
+    from unstructured.partition.pdf import partition_pdf
+
+    partition_pdf(
+        file=io.BytesIO(data),
+        strategy="hi_res",
+        extract_image_block_types=["Image"],
+        extract_image_block_output_dir=figures_dir,
+        extract_image_block_to_payload=False,  # Save images as files
+    )
+    return [os.path.join(figures_dir, name) for name in sorted(os.listdir(figures_dir))
+            if name.lower().endswith((".png", ".jpg", ".jpeg"))]
+
+
+def extract_figures(source, figures_dir, strategy=None, workers=None):
+    """Writes a PDF's figures into figures_dir, ready for the image embedding stage, and returns their paths.
+
+    The default "fast" strategy saves embedded raster images and renders vector drawings
+    (charts, diagrams) to PNG, page ranges in parallel, without layout detection or OCR.
+    "hi_res" runs unstructured's partition_pdf instead, for scanned papers with no embedded figures.
+    """
+    strategy = strategy or FIGURE_STRATEGY
+    if strategy not in ("fast", "hi_res"):
+        raise ValueError(f"Unknown figure strategy: {strategy}")
+    data = _read_source(source)
+    os.makedirs(figures_dir, exist_ok=True)
+    with span("pdf.figures", strategy=strategy, bytes_in=len(data)) as attrs:
+        if strategy == "hi_res":
+            figures = _extract_figures_hi_res(data, figures_dir)
+        else:
+            figures = _extract_figures_fast(data, figures_dir, workers)
+        attrs["figures"] = len(figures)
+        attrs["bytes_out"] = sum(os.path.getsize(figure) for figure in figures)
+    return figures
+
+
+def _extract_pymupdf(data, figures_dir, workers=None):
+    """Reads page text, the section outline and (if figures_dir is given) embedded images with PyMuPDF."""
+    with _open_document("pymupdf", data) as doc:
+        pages = extract_page_texts(data, "pymupdf", workers, handle=doc)
+        with span("pdf.sections") as attrs:
+            outline = detect_outline(doc, pages) or _regex_outline(pages)
+            attrs["headings"] = len(outline)
+        figures = None if figures_dir is None else [
+            path for page_index, images in sorted(_first_image_pages(doc).items())
+            for path in _page_figures(doc, page_index, images, figures_dir)]
+    return pages, figures, outline
+
+
+def _extract_pypdf2(data, figures_dir, workers=None):
+    """Fallback reader for files PyMuPDF cannot open."""
+    reader = _open_document("pypdf2", data)
+    pages = extract_page_texts(data, "pypdf2", workers, handle=reader)
+    if figures_dir is None:
+        return pages, None, _regex_outline(pages)
+    figures = []
+    for page_number, page in enumerate(reader.pages, start=1):
+        try:
+            images = page.images
+        except Exception:
+            images = []
+        for image_number, image in enumerate(images, start=1):
+            ext = os.path.splitext(image.name)[1] or ".png"
+            path = os.path.join(figures_dir, f"figure-{page_number}-{image_number}{ext}")
+            with open(path, "wb") as f:
+                f.write(image.data)
+            figures.append(path)
+    return pages, figures, _regex_outline(pages)
+
+
+BACKENDS = {
+    "pymupdf": _extract_pymupdf,
+    "pypdf2": _extract_pypdf2,
+}
+
+
+def _cache_dir(digest):
+    return os.path.join(INGEST_CACHE_DIR, digest)
+
+
+def _document_path(digest, backends):
+    # One file per backend list, so asking for a specific backend never returns another backend's parse
+    return os.path.join(_cache_dir(digest), f"document-{'+'.join(backends)}.json")
+
+
+def _usable(document, figures):
+    """Whether a cached document answers this request: figures extracted if asked for, and still on disk."""
+    if document is None or document.figures is None:
+        return document is not None and not figures
+    # Figures may have been cleaned up independently of the text
+    return all(os.path.exists(figure) for figure in document.figures)
+
+
+def _load_cached(digest, backends):
+    try:
+        with open(_document_path(digest, backends), "r", encoding="utf-8") as f:
+            return PaperDocument(**json.load(f))
+    except (OSError, ValueError, TypeError):
+        return None
+
+
+def _store_cached(document, backends):
+    directory = _cache_dir(document.file_hash)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(asdict(document), f)
+    os.replace(tmp_path, _document_path(document.file_hash, backends))
+
+
+def _parse_pdf(data, digest, backends, workers, figures):
+    """Extracts a PDF with the first backend that succeeds and stores the result in the ingest cache."""
+    directory = _cache_dir(digest)
+    os.makedirs(directory, exist_ok=True)
+    # Extract into a private directory, so concurrent sessions ingesting the same file never write the same paths
+    staging_dir = tempfile.mkdtemp(dir=directory, prefix="figures-") if figures else None
+    errors = []
+    for backend in backends:
+        try:
+            pages, figure_paths, outline = BACKENDS[backend](data, staging_dir, workers)
+            break
+        except Exception as e:
+            errors.append(f"{backend}: {e}")
+    else:
+        if staging_dir:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+        raise RuntimeError("Could not extract the PDF: " + "; ".join(errors))
+    if staging_dir:
+        figures_dir = os.path.join(directory, f"figures-{backend}")
+        try:
+            os.rename(staging_dir, figures_dir)
+            figure_paths = [os.path.join(figures_dir, os.path.basename(figure)) for figure in figure_paths]
+        except OSError:
+            pass  # Another session's figures are already in place; this document keeps its own copy
+    text = "\n".join(pages)
+    document = PaperDocument(
+        file_hash=digest,
+        backend=backend,
+        pages=pages,
+        sections=outline_sections(text, outline) if outline else split_into_sections(text),
+        figures=figure_paths,
+        outline=outline,
+    )
+    _store_cached(document, backends)
+    return document
+
+
+def ingest_pdf(source, backends=DEFAULT_BACKENDS, workers=None, figures=False):
+    """Returns the PaperDocument for a PDF, parsing it only the first time its content is seen with these backends.
+
+    workers sets the process count for page-parallel text extraction (default PDF_WORKERS; 1 reads serially).
+    Embedded images are only written to disk when figures=True; text-only callers leave document.figures None.
+    """
+    data = _read_source(source)
+    digest = file_hash(data)
+    backends = tuple(backends)
+
+    with span("pdf.extract", bytes_in=len(data)) as attrs:
+        with _documents_lock:
+            document = _documents.get((digest, backends))
+        if not _usable(document, figures):
+            document = _load_cached(digest, backends)
+        attrs["cache_hit"] = _usable(document, figures)
+        if not attrs["cache_hit"]:
+            document = _parse_pdf(data, digest, backends, workers, figures)
+        attrs["pages"] = len(document.pages)
+        attrs["bytes_out"] = sum(len(page.encode("utf-8")) for page in document.pages)
+
+    with _documents_lock:
+        _documents[(digest, backends)] = document
+    return document
+
+
+def extract_text_pypdf2(pdf_path):
+    try:
+        return ingest_pdf(pdf_path, backends=("pypdf2",)).text
+    except Exception as e:
+        return f"An error occurred with PyPDF2: {e}"
+
+
+def extract_text_pymupdf(pdf_path):
+    try:
+        return ingest_pdf(pdf_path, backends=("pymupdf",)).text
+    except Exception as e:
+        return f"An error occurred with PyMuPDF: {e}"
@@ -0,0 +1,288 @@
+"""Slide deck stages of the PPT pipeline: Gemini summary and slide prompts, slide parsing and the PowerPoint builder.
+
+Gemini must be configured (genai.configure) by the caller before the prompt stages run.
+"""
+import os
+import re
+
+import google.generativeai as genai
+from pptx import Presentation
+from pptx.dml.color import RGBColor
+from pptx.enum.shapes import MSO_SHAPE
+from pptx.enum.text import PP_ALIGN
+from pptx.util import Inches, Pt
+
+from image_index import MIN_IMAGE_SIMILARITY, ImageRetriever
+from llm_cache import cached_completion
+from model_registry import get_model
+from section_index import CONTEXT_TOKEN_BUDGET, build_context
+from tracing import span
+
+GEMINI_MODEL = "gemini-1.5-pro-latest"
+CLIP_MAX_TOKENS = 77  # CLIP's text encoder input length
+SUMMARY_QUERY = "Summarize the methodology and results of this research paper in extreme detail in atleast 1500 words"
+
+# Define template styles
+TEMPLATES = {
+    "LIGHT": {
+        "background_color": RGBColor(255, 255, 255),
+        "title_color": RGBColor(0, 51, 102),
+        "text_color": RGBColor(0, 0, 0),
+        "font_size_title": 36,
+        "font_size_content": 24,
+    },
+    "FUN": {
+        "background_color": RGBColor(255, 223, 186),
+        "title_color": RGBColor(255, 0, 102),
+        "text_color": RGBColor(51, 51, 51),
+        "font_size_title": 34,
+        "font_size_content": 22,
+    },
+    "DARK": {
+        "background_color": RGBColor(34, 34, 34),
+        "title_color": RGBColor(0, 255, 255),
+        "text_color": RGBColor(255, 255, 255),
+        "font_size_title": 32,
+        "font_size_content": 20,
+    },
+}
+
+
+def generate_contextual_summary(query, chunk_index, token_budget=CONTEXT_TOKEN_BUDGET, top_k=40, use_cache=True):
+    """Retrieves relevant chunks and generates a Gemini-powered summary."""
+    relevant_chunks = chunk_index.query(query, top_k)
+
+    # Pack the best chunks into the token budget instead of pasting whole sections
+    context = build_context(relevant_chunks, token_budget)
+
+    model = genai.GenerativeModel(GEMINI_MODEL)
+    prompt = f"""
+    Read the following research paper sections and generate a highly detailed and insightful summary.
+    The summary should retain all key technical details, equations (if applicable), findings, and methodology descriptions.
+
+    Research Sections:
+    {context}
+
+    Provide a deep and thorough summary:
+    """
+    # Responses are cached by model and prompt, so re-running on the same paper skips the API call
+    response_text = cached_completion(GEMINI_MODEL, [prompt], {}, lambda: model.generate_content(prompt).text,
+                                      use_cache=use_cache)
+    return response_text.strip()
+
+
+def generate_slide_content(contextual_summary, use_cache=True):
+    """Uses Gemini API to convert a detailed summary into structured slide content."""
+    model = genai.GenerativeModel(GEMINI_MODEL)
+
+    prompt = f"""
+    Convert the following detailed research summary into structured slide content
+    for a professional conference presentation. Ensure each slide has:
+
+    - A clear and engaging title
+    - Key points formatted concisely
+    - Technical details found throughout the paper
+    - At least 5 to 6 relevant bullet points per slide
+    - A logical flow from background to findings and conclusion
+    - Aesthetic appeal for a professional audience
+
+    Format the response as:
+    *Slide Title: [Title]*
+    *Content:*
+    - Bullet point 1
+    - Bullet point 2
+    - Bullet point 3
+    - Bullet point 4
+    - Bullet point 5
+    - Bullet point 6
+
+    Detailed Research Summary:
+    {contextual_summary}
+    """
+
+    response_text = cached_completion(GEMINI_MODEL, [prompt], {}, lambda: model.generate_content(prompt).text,
+                                      use_cache=use_cache)
+
+    return response_text.strip()
+
+
+def preprocess_slide_content(slide_content):
+    """Parses slide content into a structured format for PowerPoint generation."""
+    slides = []
+
+    # Adjusted regex split to preserve first slide
+    slide_blocks = re.split(r"[\*\_]{1,2}Slide Title: (.+?)[\*\_]{1,2}\n", slide_content.strip())
+
+    if not slide_blocks[0].strip():  # If there's an empty block at the beginning, remove it
+        slide_blocks = slide_blocks[1:]
+
+    for i in range(0, len(slide_blocks), 2):
+        title = slide_blocks[i].strip()  # Extract title
+        content_block = slide_blocks[i + 1].strip()  # Extract content under this title
+
+        # Extract bullet points
+        bullet_points = re.findall(r"^- (.+)", content_block, re.MULTILINE)
+
+        # Remove Markdown bold (**text**) and italic (*text*)
+        clean_bullets = [re.sub(r"\*\*(.*?)\*\*|\*(.*?)\*", r"\1\2", point) for point in bullet_points]
+
+        # Remove <sub>...</sub> tags
+        clean_bullets = [re.sub(r"<sub>(.*?)<\/sub>", r"\1", point) for point in clean_bullets]
+
+        slides.append({"title": title, "content": clean_bullets})
+
+    return slides
+
+
+def preprocess_query(query, max_tokens=CLIP_MAX_TOKENS):
+    """Truncate the query properly to fit CLIP's max token length."""
+    tokenizer = get_model("clip-tokenizer")
+    encoded = tokenizer(query, truncation=True, max_length=max_tokens, return_tensors="pt")
+    return tokenizer.decode(encoded["input_ids"][0], skip_special_tokens=True)
+
+
+def preprocess_queries(queries, max_tokens=CLIP_MAX_TOKENS):
+    """Truncates a batch of queries to CLIP's max token length in one tokenizer call."""
+    if not queries:
+        return []
+    tokenizer = get_model("clip-tokenizer")
+    encoded = tokenizer(queries, truncation=True, max_length=max_tokens)
+    return tokenizer.batch_decode(encoded["input_ids"], skip_special_tokens=True)
+
+
+def _add_placeholder(slide, left, top, width, height):
+    placeholder = slide.shapes.add_shape(MSO_SHAPE.RECTANGLE, left, top, width, height)
+    placeholder.fill.solid()
+    placeholder.fill.fore_color.rgb = RGBColor(200, 200, 200)
+    placeholder.text = "Image Here"
+
+
+def _related_figures(queries, assigned_images, paper_id, min_similarity):
+    """Gives slides left without a figure the closest figure from other papers in the figure corpus."""
+    from corpus_index import search_corpus
+
+    missing = [index for index, image in enumerate(assigned_images) if image is None]
+    if not missing:
+        return assigned_images
+    results = search_corpus("figures", [queries[index] for index in missing], top_k=len(missing),
+                            exclude_paper_ids=[paper_id])
+    assigned_images = list(assigned_images)
+    used = set()
+    for index, hits in zip(missing, results):
+        for score, entry in hits:
+            # Corpus entries can outlive the job folder their figure was extracted into
+            if score >= min_similarity and entry["path"] not in used and os.path.exists(entry["path"]):
+                assigned_images[index] = (entry["path"], score)
+                used.add(entry["path"])
+                break
+    return assigned_images
+
+
+def create_presentation(slides_data, template="LIGHT", output_filename="research_presentation.pptx", retriever=None,
+                        min_similarity=MIN_IMAGE_SIMILARITY, index_path="image_faiss.index",
+                        paths_file="image_paths.txt", related_paper_id=None):
+    """Generates a PowerPoint with alternating image positions and title layering.
+
+    With related_paper_id (the paper's content hash), slides with no good figure of their own
+    get a related figure from other papers in the figure corpus instead of a placeholder.
+    """
+    prs = Presentation()
+
+    # Match every content slide to a distinct figure at once, so early slides cannot take
+    # a figure a later slide needs more; weak matches (< min_similarity) get the placeholder
+    queries = [slide_data["title"] + " " + " ".join(slide_data["content"]) for slide_data in slides_data[1:]]
+    try:
+        # The CLIP tokenizer is loaded here too, so a missing tokenizer also falls back to placeholders
+        queries = preprocess_queries(queries)
+        # Load the FAISS index and image paths once; used images are tracked in memory
+        if retriever is None:
+            retriever = ImageRetriever(get_model("clip"), index_path, paths_file)
+        assigned_images = retriever.assign_optimal(queries, min_similarity=min_similarity)
+    except Exception as e:
+        print(f"⚠️ Image retrieval failed: {e}. Using placeholders instead.")
+        assigned_images = [None] * len(queries)
+    if related_paper_id is not None:
+        try:
+            assigned_images = _related_figures(queries, assigned_images, related_paper_id, min_similarity)
+        except Exception as e:
+            print(f"⚠️ Related figure search failed: {e}. Keeping the paper's own figures.")
+
+    if template not in TEMPLATES:
+        print(f"Invalid template: {template}. Defaulting to LIGHT.")
+        template = "LIGHT"
+
+    style = TEMPLATES[template]
+
+    # ---- First Slide: Research Paper Title ----
+    first_slide = prs.slides.add_slide(prs.slide_layouts[0])
+    first_slide.background.fill.solid()
+    first_slide.background.fill.fore_color.rgb = style["background_color"]
+
+    title_shape = first_slide.shapes.title
+    title_shape.text = slides_data[0]["title"]
+    title_shape.text_frame.paragraphs[0].font.size = Pt(44)
+    title_shape.text_frame.paragraphs[0].font.bold = True
+    title_shape.text_frame.paragraphs[0].font.color.rgb = style["title_color"]
+    title_shape.text_frame.paragraphs[0].alignment = PP_ALIGN.CENTER
+
+    # ---- Content Slides ----
+    for index, slide_data in enumerate(slides_data[1:]):
+        slide = prs.slides.add_slide(prs.slide_layouts[5])
+        slide.background.fill.solid()
+        slide.background.fill.fore_color.rgb = style["background_color"]
+
+        # Title Formatting
+        title_shape = slide.shapes.title
+        title_shape.text = slide_data["title"]
+        title_shape.text_frame.paragraphs[0].font.size = Pt(style["font_size_title"])
+        title_shape.text_frame.paragraphs[0].font.bold = True
+        title_shape.text_frame.paragraphs[0].font.color.rgb = style["title_color"]
+        title_shape.text_frame.paragraphs[0].alignment = PP_ALIGN.LEFT
+
+        # Image Alternating Left and Right
+        if index % 2 == 0:
+            img_left = Inches(0.5)
+            text_left = Inches(4.4)
+        else:
+            img_left = Inches(6.2)
+            text_left = Inches(0.5)
+
+        img_top = Inches(1.5)
+        img_width = Inches(3.5)
+        img_height = Inches(4.5)
+
+        try:
+            query = queries[index]
+            retrieved_image = assigned_images[index]
+
+            if retrieved_image:
+                image_path = retrieved_image[0]
+                slide.shapes.add_picture(image_path, img_left, img_top, width=img_width, height=img_height)
+            else:
+                print(f"⚠️ No relevant image found for query: {query}. Using placeholder instead.")
+                _add_placeholder(slide, img_left, img_top, img_width, img_height)
+        except Exception as e:
+            print(f"⚠️ Could not load image: {e}. Using placeholder instead.")
+            _add_placeholder(slide, img_left, img_top, img_width, img_height)
+
+        # Text Box (Opposite to Image)
+        text_top = Inches(1.2)
+        text_width = Inches(5.5)
+        text_height = Inches(5)
+
+        textbox = slide.shapes.add_textbox(text_left, text_top, text_width, text_height)
+        text_frame = textbox.text_frame
+        text_frame.word_wrap = True
+        text_frame.clear()
+
+        for point in slide_data["content"]:
+            p = text_frame.add_paragraph()
+            p.text = f"• {point}"
+            p.space_after = Pt(10)
+            p.font.size = Pt(style["font_size_content"])
+            p.font.color.rgb = style["text_color"]
+
+    with span("pptx.save", slides=len(slides_data)) as attrs:
+        prs.save(output_filename)
+        attrs["bytes_out"] = os.path.getsize(output_filename)
+    print(f"✅ Presentation saved as {output_filename}")
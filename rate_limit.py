@@ -0,0 +1,67 @@
+"""Process-wide request rate limits, shared by every thread that calls the same backend."""
+import os
+import threading
+import time
+
+# Requests per minute for each backend; 0 means unlimited
+DEFAULT_LIMITS = {
+    "llm": float(os.getenv("LLM_REQUESTS_PER_MINUTE", "0")),
+    "tts": float(os.getenv("TTS_REQUESTS_PER_MINUTE", "0")),
+}
+
+
+class RateLimiter:
+    """Spaces calls evenly so no more than per_minute of them start in any minute."""
+
+    def __init__(self, per_minute=0):
+        self.per_minute = per_minute
+        self.calls = 0
+        self.waited_seconds = 0.0
+        self._next_start = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until the next call may start and returns the seconds spent waiting."""
+        with self._lock:
+            self.calls += 1
+            if not self.per_minute:
+                return 0.0
+            now = time.monotonic()
+            start = max(now, self._next_start)
+            # Reserve the slot before sleeping, so concurrent callers queue up behind each other
+            self._next_start = start + 60.0 / self.per_minute
+            wait = start - now
+            self.waited_seconds += wait
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def stats(self):
+        with self._lock:
+            return {"per_minute": self.per_minute, "calls": self.calls, "waited_seconds": self.waited_seconds}
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(name):
+    """Returns the shared limiter for a backend, creating it from DEFAULT_LIMITS on first use."""
+    with _limiters_lock:
+        limiter = _limiters.get(name)
+        if limiter is None:
+            limiter = _limiters[name] = RateLimiter(DEFAULT_LIMITS.get(name, 0))
+    return limiter
+
+
+def set_rate_limit(name, per_minute):
+    """Changes a backend's limit for the rest of the process (0 removes it)."""
+    limiter = get_limiter(name)
+    with limiter._lock:
+        limiter.per_minute = per_minute
+
+
+def rate_limit_stats():
+    with _limiters_lock:
+        limiters = dict(_limiters)
+    return {name: limiter.stats() for name, limiter in limiters.items()}
@@ -0,0 +1,191 @@
+"""Per-paper section and chunk embeddings, stored by document hash and searched by cosine similarity."""
+import bisect
+import hashlib
+import json
+import os
+import tempfile
+
+import faiss
+
+from model_registry import get_model
+from pdf_ingest import FRONT_MATTER
+from tracing import span
+
+SECTION_INDEX_DIR = os.getenv("SECTION_INDEX_DIR", ".section_index")
+EMBEDDING_MODEL = "minilm"
+CHUNK_OVERLAP_TOKENS = 32
+CONTEXT_TOKEN_BUDGET = 3000  # Tokens of retrieved text packed into a summary prompt
+
+
+class SectionIndex:
+    """Normalised inner-product index over one paper's sections.
+
+    Built once per document hash and reloaded from disk afterwards, so a second deck or
+    summary for the same paper does not re-embed anything.
+    """
+
+    KIND = "sections"
+
+    def __init__(self, doc_hash, entries, index, model_name=EMBEDDING_MODEL, text_hash=None):
+        self.doc_hash = doc_hash
+        self.entries = entries
+        self.index = index
+        self.model_name = model_name
+        self.text_hash = text_hash  # Hash of the embedded texts, so an edited item is re-embedded
+
+    @property
+    def names(self):
+        return self.entries
+
+    @staticmethod
+    def _texts(items):
+        """Returns (entries stored with the index, texts to embed) for the items being indexed."""
+        return list(items.keys()), list(items.values())
+
+    @staticmethod
+    def _text_hash(texts):
+        return hashlib.sha256(json.dumps(texts).encode("utf-8")).hexdigest()
+
+    @classmethod
+    def _paths(cls, doc_hash):
+        directory = os.path.join(SECTION_INDEX_DIR, doc_hash)
+        return (directory, os.path.join(directory, f"{cls.KIND}.index"),
+                os.path.join(directory, f"{cls.KIND}.json"))
+
+    @classmethod
+    def build(cls, doc_hash, items, model_name=EMBEDDING_MODEL):
+        """Embeds every item in one encode call and saves the index.
+
+        A paper with no extractable text (e.g. a scanned PDF) gets an empty index, whose queries return nothing.
+        """
+        entries, texts = cls._texts(items)
+        model = get_model(model_name)
+        index = faiss.IndexFlatIP(model.get_sentence_embedding_dimension())
+        if texts:
+            with span(f"embed.{cls.KIND}", model=model_name, items=len(texts),
+                      bytes_in=sum(len(text.encode("utf-8")) for text in texts)):
+                embeddings = model.encode(texts, convert_to_numpy=True, normalize_embeddings=True).astype("float32")
+            index.add(embeddings)
+        paper_index = cls(doc_hash, entries, index, model_name, cls._text_hash(texts))
+        paper_index.save()
+        return paper_index
+
+    @classmethod
+    def load(cls, doc_hash, model_name=EMBEDDING_MODEL):
+        """Returns the stored index for the document, or None if there is none for this model."""
+        _, index_path, meta_path = cls._paths(doc_hash)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta["model"] != model_name:
+                return None
+            return cls(doc_hash, meta["entries"], faiss.read_index(index_path), model_name, meta.get("text_hash"))
+        except (OSError, ValueError, KeyError, RuntimeError):
+            return None
+
+    @classmethod
+    def load_or_build(cls, doc_hash, items, model_name=EMBEDDING_MODEL):
+        paper_index = cls.load(doc_hash, model_name)
+        entries, texts = cls._texts(items)
+        if (paper_index is None or paper_index.entries != entries
+                or paper_index.text_hash != cls._text_hash(texts)):
+            paper_index = cls.build(doc_hash, items, model_name)
+        return paper_index
+
+    def save(self):
+        directory, index_path, meta_path = self._paths(self.doc_hash)
+        os.makedirs(directory, exist_ok=True)
+        # Both files are replaced atomically, so a session building the same paper never sees a partial index
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        os.close(fd)
+        faiss.write_index(self.index, tmp_path)
+        os.replace(tmp_path, index_path)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"model": self.model_name, "entries": self.entries, "text_hash": self.text_hash}, f)
+        os.replace(tmp_path, meta_path)
+
+    def query_many(self, queries, top_k=3):
+        """Returns the top_k entries for each query, encoding all queries in one call."""
+        if not queries:
+            return []
+        if self.index.ntotal == 0:
+            return [[] for _ in queries]
+        with span("faiss.search", index=self.KIND, queries=len(queries)):
+            query_embeddings = get_model(self.model_name).encode(list(queries), convert_to_numpy=True,
+                                                                 normalize_embeddings=True).astype("float32")
+            _, indices = self.index.search(query_embeddings, min(top_k, self.index.ntotal))
+        return [[self.entries[i] for i in row if i != -1] for row in indices]
+
+    def query(self, query, top_k=3):
+        return self.query_many([query], top_k)[0]
+
+
+class ChunkIndex(SectionIndex):
+    """Index over overlapping chunks (see chunk_document); entries are the chunk dicts."""
+
+    KIND = "chunks"
+
+    @staticmethod
+    def _texts(items):
+        return list(items), [chunk["text"] for chunk in items]
+
+
+def chunk_document(document, model_name=EMBEDDING_MODEL, overlap_tokens=CHUNK_OVERLAP_TOKENS):
+    """Splits a PaperDocument into overlapping chunks sized to the embedding model's input limit.
+
+    Chunks never cross a heading of the document's outline. Each chunk is a dict with its text,
+    section, start page (1-based), token count and position in the document. A paper with no
+    text gives no chunks, which ChunkIndex turns into an empty index.
+    """
+    if not document.text.strip():
+        return []
+    model = get_model(model_name)
+    tokenizer = model.tokenizer
+    chunk_tokens = model.max_seq_length - 2  # Room for the [CLS]/[SEP] tokens
+    stride = max(chunk_tokens - overlap_tokens, 1)
+
+    text = document.text
+    page_starts = []  # Offset of each page in text
+    offset = 0
+    for page_text in document.pages:
+        page_starts.append(offset)
+        offset += len(page_text) + 1
+
+    # Every heading starts a new run of chunks, named after the heading
+    boundaries = [(0, FRONT_MATTER)] + [(entry["start"], f"{entry['number']} {entry['title']}".strip())
+                                        for entry in document.outline]
+    chunks = []
+    for (begin_section, section), (end_section, _) in zip(boundaries, boundaries[1:] + [(len(text), None)]):
+        section_text = text[begin_section:end_section]
+        if not section_text.strip():
+            continue
+        offsets = tokenizer(section_text, add_special_tokens=False, return_offsets_mapping=True)["offset_mapping"]
+        for start in range(0, max(len(offsets) - overlap_tokens, 1), stride):
+            window = offsets[start:start + chunk_tokens]
+            if not window:
+                break
+            begin, end = window[0][0], window[-1][1]
+            chunks.append({
+                "id": len(chunks),
+                "section": section,
+                "page": bisect.bisect_right(page_starts, begin_section + begin),
+                "tokens": len(window),
+                "text": section_text[begin:end],
+            })
+    return chunks
+
+
+def build_context(chunks, token_budget=CONTEXT_TOKEN_BUDGET):
+    """Packs the highest-ranked chunks into the token budget, then orders them as they appear in the paper."""
+    if not chunks:
+        return ""  # Nothing retrieved (e.g. a scanned paper); the summary prompt still runs without context
+    packed = []
+    used_tokens = 0
+    for chunk in chunks:
+        if used_tokens + chunk["tokens"] > token_budget:
+            continue
+        packed.append(chunk)
+        used_tokens += chunk["tokens"]
+    packed.sort(key=lambda chunk: chunk["id"])
+    return "\n\n".join(f"{chunk['section']} (page {chunk['page']}):\n{chunk['text']}" for chunk in packed)
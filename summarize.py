@@ -0,0 +1,116 @@
+"""Token-budgeted map-reduce summarization for papers that do not fit in a model's context window."""
+from concurrent.futures import ThreadPoolExecutor
+
+from tracing import bind
+
+CHARS_PER_TOKEN = 4  # Rough average for English text when no tokenizer is installed
+SUMMARY_WORKERS = 4  # Chunks summarized concurrently in the map step
+MAX_REDUCE_ROUNDS = 3
+
+CHUNK_PROMPT = """Summarize this part of a research paper for someone who will later write about the whole paper.
+Keep the problem statement, methods, datasets, key numbers, results and conclusions. Do not add anything that is not in the text.
+
+Text:
+{text}"""
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    _encoding = None
+
+
+def count_tokens(text):
+    """Counts tokens with tiktoken if it is installed, otherwise estimates from the character count."""
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+def truncate_tokens(text, max_tokens):
+    """Returns the start of text, at most max_tokens tokens long."""
+    if _encoding is not None:
+        tokens = _encoding.encode(text, disallowed_special=())
+        return text if len(tokens) <= max_tokens else _encoding.decode(tokens[:max_tokens])
+    return text[:max_tokens * CHARS_PER_TOKEN]
+
+
+def split_by_tokens(text, chunk_tokens):
+    """Splits text on line boundaries into pieces of at most chunk_tokens tokens (long lines are cut)."""
+    chunks = []
+    current = []
+    current_tokens = 0
+    for line in text.split("\n"):
+        line_tokens = count_tokens(line) + 1
+        if line_tokens > chunk_tokens:
+            # A single huge line (e.g. whitespace-normalised page text): cut it by characters
+            step = chunk_tokens * CHARS_PER_TOKEN
+            pieces = [line[i:i + step] for i in range(0, len(line), step)]
+        else:
+            pieces = [line]
+        for piece in pieces:
+            piece_tokens = count_tokens(piece) + 1
+            if current and current_tokens + piece_tokens > chunk_tokens:
+                chunks.append("\n".join(current))
+                current, current_tokens = [], 0
+            current.append(piece)
+            current_tokens += piece_tokens
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+
+def map_reduce_summarize(text, summarize_fn, token_budget, chunk_tokens=None, max_workers=SUMMARY_WORKERS):
+    """Shrinks text until it fits in token_budget by summarizing chunks concurrently and merging them.
+
+    summarize_fn(prompt) must return the model's text. Text that already fits is returned unchanged.
+    A chunk whose call fails is kept as its own opening text, cut to its share of the budget, so one
+    API error degrades the summary instead of failing the page or batch stage.
+    Returns (text, report), where report lists the tokens in and out of every stage.
+    """
+    chunk_tokens = chunk_tokens or token_budget
+    tokens = count_tokens(text)
+    report = [{"stage": "input", "chunks": 1, "tokens_in": tokens, "tokens_out": tokens}]
+
+    for round_number in range(1, MAX_REDUCE_ROUNDS + 1):
+        if tokens <= token_budget:
+            break
+        chunks = split_by_tokens(text, chunk_tokens)
+        share = max(token_budget // len(chunks), 1)
+        failures = []
+
+        def summarize_chunk(chunk):
+            try:
+                return summarize_fn(CHUNK_PROMPT.format(text=chunk))
+            except Exception as e:
+                print(f"❌ Chunk summary failed, keeping the chunk's opening text: {e}")
+                failures.append(str(e))
+                return truncate_tokens(chunk, share)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            summaries = list(executor.map(bind(summarize_chunk), chunks))
+        text = "\n\n".join(summary.strip() for summary in summaries if summary)
+        new_tokens = count_tokens(text)
+        report.append({
+            "stage": "map" if round_number == 1 else f"reduce {round_number - 1}",
+            "chunks": len(chunks),
+            "tokens_in": tokens,
+            "tokens_out": new_tokens,
+            "failed": len(failures),
+        })
+        if new_tokens >= tokens:
+            break  # Summaries are not getting shorter; stop rather than loop
+        tokens = new_tokens
+
+    report.append({"stage": "final", "chunks": 1, "tokens_in": tokens, "tokens_out": tokens,
+                   "budget": token_budget, "within_budget": tokens <= token_budget})
+    return text, report
+
+
+def format_report(report):
+    """One-line description of a map_reduce_summarize report for the UI."""
+    return " → ".join(
+        f"{stage['stage']}: {stage['tokens_out']:,} tokens" + (f" ({stage['chunks']} chunks)" if stage["chunks"] > 1 else "")
+        + (f" [{stage['failed']} failed]" if stage.get("failed") else "")
+        for stage in report
+    ) + f" (budget {report[-1]['budget']:,})"
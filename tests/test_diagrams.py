@@ -0,0 +1,24 @@
+"""Workflow diagram rendering (diagrams.py)."""
+import io
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from PIL import Image
+
+from diagrams import PNG_SCALE, layout_workflow, parse_workflow, render_workflow_png
+
+WORKFLOW = "step1[Load the dataset] --> step2[Train the model]\nstep2 --> step3[Evaluate on held-out papers]\n"
+
+
+@pytest.mark.parametrize("scale", [1, 1.5, PNG_SCALE, 3])
+def test_png_size_follows_scale(scale):
+    layout = layout_workflow(*parse_workflow(WORKFLOW))
+    image = Image.open(io.BytesIO(render_workflow_png(WORKFLOW, scale=scale)))
+    assert image.size == (int(layout["width"] * scale), int(layout["height"] * scale))
+
+
+def test_png_without_steps():
+    assert render_workflow_png("no steps here", scale=1.5) is None
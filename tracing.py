@@ -0,0 +1,167 @@
+"""Lightweight spans that time pipeline stages, exportable as JSON or Chrome trace (chrome://tracing, Perfetto) files.
+
+Code marks a stage with `with span("tts") as attrs:` and may fill attrs with bytes, tokens or
+cache hits. Spans are only recorded while a Trace is active (`with trace.activate():`), so the
+instrumentation costs next to nothing in runs that are not traced.
+"""
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Counters summed per stage name in Trace.summary()
+COUNTERS = ("bytes_in", "bytes_out", "tokens_in", "tokens_out")
+
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+class Trace:
+    """The spans recorded during one run (a Streamlit generation, a batch paper, a job)."""
+
+    def __init__(self, name="run"):
+        self.name = name
+        self.spans = []
+        self.created_at = time.time()
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def activate(self):
+        """Records spans from this thread (and from functions wrapped with bind()) into this trace."""
+        token = _current_trace.set(self)
+        try:
+            yield self
+        finally:
+            _current_trace.reset(token)
+
+    @classmethod
+    def from_dict(cls, data):
+        """Rebuilds a trace saved with save_json (e.g. a job's trace.json) so it can be summarized again."""
+        trace = cls(data["name"])
+        trace.created_at = data["created_at"]
+        trace.spans = data["spans"]
+        return trace
+
+    def add(self, record):
+        with self._lock:
+            self.spans.append(record)
+
+    def summary(self):
+        """Returns {stage: count, seconds, cache_hits and summed counters}, in order of first appearance."""
+        stages = {}
+        with self._lock:
+            spans = list(self.spans)
+        for record in sorted(spans, key=lambda record: record["start"]):
+            stage = stages.setdefault(record["name"], {"count": 0, "seconds": 0.0, "cache_hits": 0,
+                                                       **{counter: 0 for counter in COUNTERS}})
+            stage["count"] += 1
+            stage["seconds"] += record["seconds"]
+            stage["cache_hits"] += bool(record["attrs"].get("cache_hit"))
+            for counter in COUNTERS:
+                stage[counter] += record["attrs"].get(counter) or 0
+        return stages
+
+    def wall_seconds(self):
+        with self._lock:
+            return max((record["start"] + record["seconds"] for record in self.spans), default=0.0)
+
+    def to_dict(self):
+        with self._lock:
+            spans = list(self.spans)
+        return {"name": self.name, "created_at": self.created_at, "wall_seconds": self.wall_seconds(),
+                "summary": self.summary(), "spans": spans}
+
+    def to_chrome_trace(self):
+        """Returns the spans as Chrome trace "complete" events (timestamps in microseconds)."""
+        with self._lock:
+            spans = list(self.spans)
+        events = [{
+            "name": record["name"],
+            "ph": "X",
+            "ts": record["start"] * 1e6,
+            "dur": record["seconds"] * 1e6,
+            "pid": os.getpid(),
+            "tid": record["thread"],
+            "args": record["attrs"],
+        } for record in spans]
+        return {"traceEvents": events, "displayTimeUnit": "ms", "otherData": {"trace": self.name}}
+
+    def save_json(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=2, default=str)
+
+    def save_chrome_trace(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_chrome_trace(), f, default=str)
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+@contextmanager
+def span(name, **attrs):
+    """Times the block as a stage of the active trace and yields its attrs dict for the block to fill in."""
+    trace = _current_trace.get()
+    if trace is None:
+        yield attrs
+        return
+    start = time.perf_counter()
+    try:
+        yield attrs
+    except Exception as e:
+        attrs["error"] = str(e)
+        raise
+    finally:
+        trace.add({
+            "name": name,
+            "start": start - trace._origin,
+            "seconds": time.perf_counter() - start,
+            "thread": threading.get_ident(),
+            "attrs": attrs,
+        })
+
+
+def bind(fn):
+    """Wraps fn so calls from worker threads record into the trace active where bind() was called.
+
+    Thread pools do not inherit context variables, so pass bind(fn) to executor.submit/map.
+    """
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        # Each call gets its own copy, because one context cannot be entered by two threads at once
+        return context.copy().run(fn, *args, **kwargs)
+    return run
+
+
+def format_summary(summary):
+    """Rows for a per-stage breakdown table (e.g. st.dataframe)."""
+    return [{
+        "stage": name,
+        "calls": stage["count"],
+        "seconds": round(stage["seconds"], 3),
+        "cache hits": stage["cache_hits"],
+        "KB in": round(stage["bytes_in"] / 1024, 1),
+        "KB out": round(stage["bytes_out"] / 1024, 1),
+        "tokens in": stage["tokens_in"],
+        "tokens out": stage["tokens_out"],
+    } for name, stage in summary.items()]
+
+
+def render_trace_sidebar(trace):
+    """Shows the run's per-stage timing breakdown in the Streamlit sidebar, with JSON and Chrome trace downloads."""
+    import streamlit as st
+
+    summary = trace.summary()
+    if not summary:
+        return
+    st.sidebar.markdown(f"#### ⏱️ This run: {trace.wall_seconds():.2f}s")
+    st.sidebar.dataframe(format_summary(summary), hide_index=True)
+    st.sidebar.download_button("Download trace (JSON)", json.dumps(trace.to_dict(), indent=2, default=str),
+                               file_name=f"{trace.name}-trace.json", mime="application/json")
+    st.sidebar.download_button("Download Chrome trace", json.dumps(trace.to_chrome_trace(), default=str),
+                               file_name=f"{trace.name}-chrome-trace.json", mime="application/json",
+                               help="Open in chrome://tracing or ui.perfetto.dev")
@@ -0,0 +1,90 @@
+"""Private scratch directories for one session or job, removed automatically when it ends,
+and persistent per-paper directories for figures and image indexes that later runs reuse."""
+import os
+import shutil
+import tempfile
+import time
+import weakref
+
+WORKSPACE_ROOT = os.getenv("WORKSPACE_ROOT") or None  # None uses the system temp directory
+WORKSPACE_PREFIX = "mined-"
+STALE_WORKSPACE_SECONDS = 24 * 60 * 60  # Left behind by a killed process; swept on the next start
+PAPER_STORE_DIR = os.getenv("PAPER_STORE_DIR", ".paper_store")
+
+
+class _Directory:
+    """Path helpers shared by Workspace and PaperStore; subclasses set self.path."""
+
+    def file(self, filename):
+        """Returns the path of a file inside the directory."""
+        return os.path.join(self.path, filename)
+
+    def directory(self, name):
+        """Returns a sub-directory, creating it if needed."""
+        path = self.file(name)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    @property
+    def figures_dir(self):
+        return self.directory("figures")
+
+    @property
+    def image_index_path(self):
+        return self.file("image_faiss.index")
+
+    @property
+    def image_paths_file(self):
+        return self.file("image_paths.txt")
+
+
+class Workspace(_Directory):
+    """A temporary directory holding one session's or stage's scratch files.
+
+    Nothing in it is shared with other sessions, so concurrent users of one server process
+    cannot overwrite each other's files. The directory is deleted by cleanup(), on leaving a
+    with block, or when the workspace is garbage collected (e.g. a Streamlit session ends).
+    """
+
+    def __init__(self, name="session", root=WORKSPACE_ROOT):
+        if root is not None:
+            os.makedirs(root, exist_ok=True)
+        self.path = tempfile.mkdtemp(prefix=f"{WORKSPACE_PREFIX}{name}-", dir=root)
+        self._finalizer = weakref.finalize(self, shutil.rmtree, self.path, True)
+
+    def cleanup(self):
+        self._finalizer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.cleanup()
+
+
+class PaperStore(_Directory):
+    """A persistent directory for one paper's figures and image index, keyed by the PDF's content hash.
+
+    Unlike a Workspace it outlives the session, so the next run on the same paper finds its
+    figures already extracted and ImageIndex.update() only embeds what changed.
+    """
+
+    def __init__(self, file_hash, root=PAPER_STORE_DIR):
+        self.file_hash = file_hash
+        self.path = os.path.join(root, file_hash)
+        os.makedirs(self.path, exist_ok=True)
+
+
+def sweep_stale_workspaces(root=WORKSPACE_ROOT, max_age=STALE_WORKSPACE_SECONDS):
+    """Deletes workspaces older than max_age seconds, e.g. from a process that was killed; returns how many."""
+    root = root or tempfile.gettempdir()
+    cutoff = time.time() - max_age
+    removed = 0
+    for entry in os.scandir(root):
+        try:
+            if entry.name.startswith(WORKSPACE_PREFIX) and entry.is_dir() and entry.stat().st_mtime < cutoff:
+                shutil.rmtree(entry.path, ignore_errors=True)
+                removed += 1
+        except OSError:
+            pass
+    return removed